@@ -0,0 +1,165 @@
+"""single-pass directory index that the jdir functions can answer their queries from"""
+import os
+import os.path as opath
+from array import array
+from collections import namedtuple
+
+
+class DirIndex:
+    """
+    Index of every directory and file below root, built from a single os.scandir() pass.
+
+    The stat data that the DirEntry objects hold (or fetch with one lstat) is kept in columns: paths in a list, and
+    flags, sizes, mtimes, inodes and devices in compact typed arrays, rather than one object per entry. Column i
+    describes paths[i].
+
+    Entries are stored in the order os.walk() reports them (each directory's children together, directories visited
+    top-down in scandir order), so answers built from the index come out in the same order as those from a walk. Like
+    os.walk(), subdirectories that can't be listed are skipped and symlinked directories are listed but not descended
+    into. A root that can't be stat'ed or listed raises OSError, so a missing root isn't mistaken for an empty tree.
+
+    Example:
+        index = DirIndex('/some/tree')
+        jdir.get_size('/some/tree', index=index)
+        jdir.get_file_count('/some/tree', index=index)
+    """
+    __slots__ = ('root', 'paths', 'flags', 'sizes', 'mtimes', 'inodes', 'devices', 'dir_mtimes', 'total_size',
+                 'dir_count')
+
+    # bits in flags
+    IS_DIR = 1      # entry.is_dir(), which follows symlinks the way os.walk() classifies entries
+    IS_SYMLINK = 2
+    IS_FILE = 4     # a regular file (not a symlink to one)
+
+    Entry = namedtuple('Entry', 'path is_dir is_symlink is_file size mtime_ns inode device')
+
+    def __init__(self, root):
+        self.root = root
+        self.paths = []
+        self.flags = bytearray()
+        self.sizes = array('q')
+        self.mtimes = array('q') # st_mtime_ns
+        self.inodes = array('Q')
+        self.devices = array('Q')
+        self.dir_mtimes = {} # st_mtime_ns of every directory walked (root included), used by is_current()
+        self.total_size = 0 # what get_size() reports: sizes of all entries that aren't symlinks
+        self.dir_count = 0
+        self._scan()
+
+    def _scan(self):
+        self.dir_mtimes[self.root] = os.stat(self.root).st_mtime_ns
+        stack = [self.root]
+        while stack:
+            top = stack.pop()
+            try:
+                with os.scandir(top) as it:
+                    entries = list(it)
+            except OSError:
+                if top == self.root:
+                    raise
+                continue
+            subdirs = []
+            for entry in entries:
+                self._add(entry)
+                if self.flags[-1] == DirIndex.IS_DIR:
+                    subdirs.append(entry.path)
+                    self.dir_mtimes[entry.path] = self.mtimes[-1]
+            # reversed so that the first subdirectory is popped (walked) first
+            stack.extend(reversed(subdirs))
+
+    def _add(self, entry):
+        """append one os.DirEntry to the columns"""
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        is_symlink = entry.is_symlink()
+        try:
+            is_file = entry.is_file(follow_symlinks=False)
+        except OSError:
+            is_file = False
+        try:
+            st = entry.stat(follow_symlinks=False)
+            size, mtime, inode, device = st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev
+        except OSError:
+            size, mtime, inode, device = 0, 0, 0, 0
+        self.paths.append(entry.path)
+        self.flags.append(is_dir * DirIndex.IS_DIR | is_symlink * DirIndex.IS_SYMLINK | is_file * DirIndex.IS_FILE)
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+        self.inodes.append(inode)
+        self.devices.append(device)
+        if not is_symlink:
+            self.total_size += size
+        self.dir_count += is_dir
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        """yield an Entry for each indexed path, in walk order"""
+        for i, path in enumerate(self.paths):
+            flags = self.flags[i]
+            yield DirIndex.Entry(path, bool(flags & DirIndex.IS_DIR), bool(flags & DirIndex.IS_SYMLINK),
+                                 bool(flags & DirIndex.IS_FILE), self.sizes[i], self.mtimes[i], self.inodes[i],
+                                 self.devices[i])
+
+    def all_files(self):
+        """return [[subdirectories], [sub-files]] like jdir.get_all_files()"""
+        dirs, files = [], []
+        for path, flags in zip(self.paths, self.flags):
+            if flags & DirIndex.IS_DIR:
+                dirs.append(path)
+            else:
+                files.append(path)
+        return [dirs, files]
+
+    def file_count(self):
+        """return (num_dirs, num_files) like jdir.get_file_count()"""
+        return (self.dir_count, len(self.paths) - self.dir_count)
+
+    def is_current(self):
+        """
+        return False if any directory in the index has been modified (or removed) since the index was built.
+
+        Only directory mtimes are checked, which costs one stat per directory instead of a full walk. They catch entries
+        being created, deleted or renamed, but not a file being rewritten in place, so sizes and mtimes of existing files
+        may be stale even when this returns True.
+        """
+        for path, mtime in self.dir_mtimes.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return bool(self.dir_mtimes)
+
+    @classmethod
+    def cached(cls, root):
+        """return the index of root kept from an earlier call, if it is still current (see is_current()), otherwise build
+        and keep a new one."""
+        index = _cache.get(root)
+        if index is None or not index.is_current():
+            index = cls(root)
+            _cache[root] = index
+        return index
+
+
+# DirIndex.cached() indexes, by root
+_cache = {}
+
+
+def resolve_index(pathstring, index=None, cached=False):
+    """
+    return the DirIndex that a jdir query on pathstring should be answered from, or None if it should walk the tree.
+
+    @param index: a DirIndex (or a jdir.watcher.TreeWatcher), which must have been built for pathstring
+    @param cached: use DirIndex.cached(pathstring)
+    """
+    if index is not None:
+        if opath.abspath(index.root) != opath.abspath(pathstring):
+            raise ValueError(f'index of {index.root} can\'t answer for {pathstring}')
+        return index
+    if cached:
+        return DirIndex.cached(pathstring)
+    return None
@@ -0,0 +1,151 @@
+"""persistent disk usage cache that lets jdir.get_size() skip the parts of a tree that haven't changed"""
+import os
+import sqlite3
+import time
+import os.path as opath
+
+# a directory modified this recently may be modified again within the same mtime tick, so a listing of it taken now
+# isn't trusted to match its mtime later
+RACY_NS = 2 * 10**9
+
+
+class DuCache:
+    """
+    SQLite-backed cache of directory sizes.
+
+    For every directory it has walked, the cache records the directory's mtime and own st_size, the size of the
+    entries directly in it other than subdirectories and symlinks (local_size) and the size of everything below it
+    (total_size), the same sum jdir.get_size() computes. Subdirectories are left out of local_size because a
+    directory's own size changes as entries are added to it, without changing its parent's mtime. A later
+    get_size() stats each cached directory, lists again only the ones whose mtime changed, and rolls the new totals
+    up to the root. That is one stat per directory rather than one per file, and no listing at all for the parts of
+    the tree that are unchanged.
+
+    A directory's mtime changes when entries are created, deleted or renamed in it, but not when a file in it is
+    rewritten in place, so a size change from appending to an existing file shows up only after something else
+    touches its directory.
+
+    Example:
+        with DuCache() as cache:
+            jdir.get_size('/big/tree', du_cache=cache)
+    """
+    DEFAULT_PATH = opath.join(opath.expanduser('~'), '.cache', 'jtools', 'ducache.sqlite3')
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path=None):
+        """
+        @param path: the SQLite database file, created if it doesn't exist (default DuCache.DEFAULT_PATH). ':memory:'
+            keeps the cache for the life of this object only.
+        """
+        self.path = path or DuCache.DEFAULT_PATH
+        if self.path != ':memory:':
+            os.makedirs(opath.dirname(opath.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        with self.db:
+            if self.db.execute('PRAGMA user_version').fetchone()[0] != DuCache.SCHEMA_VERSION:
+                # it's only a cache: a table in an older layout is dropped rather than migrated
+                self.db.execute('DROP TABLE IF EXISTS dirs')
+                self.db.execute(f'PRAGMA user_version = {DuCache.SCHEMA_VERSION}')
+            self.db.execute('CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER, '
+                            'size INTEGER, local_size INTEGER, total_size INTEGER)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def clear(self):
+        """forget every cached directory"""
+        with self.db:
+            self.db.execute('DELETE FROM dirs')
+
+    def get_size(self, pathstring):
+        """return jdir.get_size(pathstring), rescanning only the directories that changed since they were cached."""
+        root = opath.abspath(pathstring)
+        cached = self._load(root)
+        children = {}
+        for path, (parent, _, _, _, _) in cached.items():
+            children.setdefault(parent, []).append(path)
+
+        local, subdirs, mtimes, sizes, order, updated = {}, {}, {}, {}, [], set()
+        now = time.time_ns()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                st = os.stat(path)
+            except OSError:
+                if path == root:
+                    raise
+                continue # removed since its parent was listed
+            mtime = st.st_mtime_ns
+            sizes[path] = st.st_size
+            row = cached.get(path)
+            if row is not None and row[1] == mtime:
+                local[path] = row[3]
+                subdirs[path] = children.get(path, [])
+            else:
+                try:
+                    local[path], subdirs[path] = _scan(path)
+                except OSError:
+                    if path == root:
+                        raise
+                    continue
+                mtime = stable_mtime(mtime, now)
+                updated.add(path)
+            mtimes[path] = mtime
+            order.append(path)
+            stack.extend(subdirs[path])
+
+        # roll the totals up, children before parents. A subdirectory's own size comes from the stat above, since it
+        # can change while its parent's listing stays valid.
+        totals = {}
+        for path in reversed(order):
+            totals[path] = local[path] + sum(sizes[sub] + totals[sub] for sub in subdirs[path] if sub in totals)
+
+        visited = set(order)
+        with self.db:
+            self.db.executemany('DELETE FROM dirs WHERE path = ?',
+                                [(path,) for path in cached if path not in visited])
+            rows = [(path, opath.dirname(path), mtimes[path], sizes[path], local[path], totals[path]) for path in order]
+            self.db.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?)',
+                                [row for row in rows if row[0] in updated or cached[row[0]][1:] != row[2:]])
+        return totals[root]
+
+    def _load(self, root):
+        """return {path: (parent, mtime_ns, size, local_size, total_size)} for root and every cached directory below it"""
+        sep = opath.sep
+        prefix = root.rstrip(sep) + sep
+        # every path starting with prefix sorts between prefix and prefix with its last character incremented
+        upper = prefix[:-1] + chr(ord(sep) + 1)
+        rows = self.db.execute('SELECT path, parent, mtime_ns, size, local_size, total_size FROM dirs '
+                               'WHERE path = ? OR (path >= ? AND path < ?)', (root, prefix, upper))
+        return {path: tuple(row) for path, *row in rows}
+
+
+def stable_mtime(mtime_ns, now_ns=None):
+    """return mtime_ns, or 0 if it's less than RACY_NS before now_ns (default: the current time). 0 never matches a real
+    mtime, so a directory recorded with it is listed again on the next check."""
+    if now_ns is None:
+        now_ns = time.time_ns()
+    return 0 if now_ns - mtime_ns < RACY_NS else mtime_ns
+
+
+def _scan(path):
+    """list one directory: return (size of its entries other than symlinks and subdirectories, paths of the
+    subdirectories to descend into)"""
+    size, subdirs = 0, []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_symlink():
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            else:
+                size += entry.stat(follow_symlinks=False).st_size
+    return size, subdirs
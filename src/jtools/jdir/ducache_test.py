@@ -0,0 +1,26 @@
+import os
+import tempfile
+from jtools.jdir import jdir
+from jtools.jdir.ducache import DuCache, RACY_NS
+
+
+def test_subdirectory_growth():
+    """a subdirectory's own st_size grows as entries are added to it, which doesn't change its parent's mtime"""
+    with tempfile.TemporaryDirectory() as root, DuCache(':memory:') as cache:
+        os.makedirs(os.path.join(root, 'a', 'b'))
+        # age the directories past RACY_NS so that their cached listings are trusted
+        old = os.stat(root).st_mtime_ns - 10 * RACY_NS
+        for path in (root, os.path.join(root, 'a'), os.path.join(root, 'a', 'b')):
+            os.utime(path, ns=(old, old))
+        assert jdir.get_size(root, du_cache=cache) == jdir.get_size(root)
+
+        for i in range(350):
+            with open(os.path.join(root, 'a', 'b', f'file_with_a_long_name_{i:04}'), 'w') as f:
+                f.write('x')
+        assert jdir.get_size(root, du_cache=cache) == jdir.get_size(root)
+        assert jdir.get_size(root, du_cache=cache) == jdir.get_size(root)
+
+
+if __name__ == '__main__':
+    test_subdirectory_growth()
+    print('ok')
@@ -1,7 +1,11 @@
 """functions to help with filesystem related tasks"""
-import os, sys
+import os, sys, errno, shutil, hashlib, tempfile
+from collections import namedtuple
+from fnmatch import fnmatch
 import os.path as opath
+from concurrent.futures import ThreadPoolExecutor
 from jtools.jconsole import yes_no, test
+from jtools.jdir.dirindex import DirIndex, resolve_index
 
 
 def formatbytes(bytesize, unit="KB"):
@@ -12,26 +16,44 @@ def formatbytes(bytesize, unit="KB"):
 
 
 # rewrite to handle symlinks correctly
-def get_size(pathstring):
-    """recursively calculate a directory's size in bytes."""
+def get_size(pathstring, index=None, cached=False, workers=None, du_cache=None):
+    """recursively calculate a directory's size in bytes.
+    - if index (a DirIndex of pathstring) is given, answer from it instead of walking the tree
+    - if cached is True, answer from an index of pathstring kept between calls (see DirIndex.cached())
+    - if workers is given, list and stat directories on that many threads (see _walk_parallel())
+    - if du_cache (a DuCache) is given, answer from its persistent per-directory sizes, rescanning only the directories
+      that changed since they were cached"""
+    if du_cache is not None:
+        return du_cache.get_size(pathstring)
+    index = resolve_index(pathstring, index, cached)
+    if index is not None:
+        return index.total_size
+    if workers:
+        return sum(size for _, _, _, size in _walk_parallel(pathstring, workers, sizes=True, strict=True))
     size = 0
     for x in os.scandir(pathstring):
         if x.is_symlink():
             continue # os.path.getsize() fails w/ FileNotFound for broken symlinks and it's not clear if its returning size of the link or the link's target. 
-        size += opath.getsize(x)
+        size += x.stat(follow_symlinks=False).st_size # the DirEntry caches this (and on windows already has it from the listing)
                 
         if x.is_dir():
             size += get_size(x.path)
     return size
 
 
-def get_all_files(pathstring, combined=False):
+def get_all_files(pathstring, combined=False, index=None, cached=False, workers=None):
     """recurse into pathstring to generate a list of all files and subdirectories below that point.
     - Returns a list of lists like: [[subdirectories], [sub-files]] ()
-    - if combined is True, combine the dirs and files return lists into one list"""
+    - if combined is True, combine the dirs and files return lists into one list
+    - index, cached and workers work as in get_size()"""
+    index = resolve_index(pathstring, index, cached)
+    if index is not None:
+        dirs, files = index.all_files()
+        return dirs + files if combined else [dirs, files]
     dirs = []
     files = []
-    for dirpath, dirnames, filenames in os.walk(pathstring):
+    walk = _walk_parallel(pathstring, workers) if workers else os.walk(pathstring)
+    for dirpath, dirnames, filenames, *_ in walk:
         dirs += [opath.join(dirpath, name) for name in dirnames]
         files += [opath.join(dirpath, name) for name in filenames]
     if combined:
@@ -40,19 +62,170 @@ def get_all_files(pathstring, combined=False):
         return [dirs, files]
 
 
-def get_file_count(pathstring):
+def get_file_count(pathstring, index=None, cached=False, workers=None):
     """recursively count the number of files and sub-directories below pathstring
-     returned as a tupe (num_dirs, num_files) """
+     returned as a tupe (num_dirs, num_files) 
+     - index, cached and workers work as in get_size()"""
+    index = resolve_index(pathstring, index, cached)
+    if index is not None:
+        return index.file_count()
     d, f = 0, 0
-    for dirpath, dirnames, filenames in os.walk(pathstring):
+    walk = _walk_parallel(pathstring, workers) if workers else os.walk(pathstring)
+    for dirpath, dirnames, filenames, *_ in walk:
         d += len(dirnames)
         f += len(filenames)
     return (d,f)
 
 
+def _walk_parallel(top, workers, sizes=False, strict=False):
+    """
+    os.walk(top) with the directory listings done on a pool of threads, for filesystems where every listing waits on a
+    round trip (NFS, SMB). Yields (dirpath, dirnames, filenames, size) in exactly the order os.walk() would yield
+    (dirpath, dirnames, filenames).
+
+    Every directory is submitted to the pool's shared queue as soon as its parent has been listed, so idle threads pick
+    up whatever is waiting, breadth first, while the generator hands the listings out in walk order as they arrive.
+
+    @param workers: number of threads
+    @param sizes: also lstat every entry and report the total st_size of the directory's non-symlink entries as size
+        (otherwise size is 0). The stats run on the pool too.
+    @param strict: raise OSError from a directory that can't be listed, instead of skipping it like os.walk() does
+    """
+    pool = ThreadPoolExecutor(workers)
+    pending = {}
+
+    def submit(path):
+        pending[path] = pool.submit(_list_dir, path, sizes, strict, submit)
+
+    try:
+        submit(top)
+        stack = [top]
+        while stack:
+            dirpath = stack.pop()
+            listing = pending.pop(dirpath).result()
+            if listing is None:
+                continue
+            dirnames, filenames, walk_into, size = listing
+            yield dirpath, dirnames, filenames, size
+            stack.extend(reversed(walk_into))
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _list_dir(path, sizes, strict, submit):
+    """one task of _walk_parallel(): list path, queue its subdirectories (before returning, so they are pending by the
+    time the listing is consumed) and return (dirnames, filenames, paths of the subdirectories to walk into, size),
+    or None if path can't be listed."""
+    dirnames, filenames, walk_into, size = [], [], [], 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                is_symlink = entry.is_symlink()
+                if is_dir:
+                    dirnames.append(entry.name)
+                    if not is_symlink: # os.walk() doesn't follow symlinks by default
+                        walk_into.append(entry.path)
+                else:
+                    filenames.append(entry.name)
+                if sizes and not is_symlink:
+                    size += entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        if strict:
+            raise
+        return None
+    for subdir in walk_into:
+        try:
+            submit(subdir)
+        except RuntimeError: # the pool was shut down because the walk ended early
+            break
+    return dirnames, filenames, walk_into, size
+
+
+def iter_tree(pathstring, ext=None, glob=None, max_depth=None, exclude_dirs=(), min_size=None, max_size=None,
+              newer_than=None, older_than=None, files=True, dirs=True):
+    """
+    lazily yield an os.DirEntry for every dir/file below pathstring, depth first.
+
+    Unlike get_all_files() nothing is collected: only one open directory listing per level is held, so memory grows
+    with the depth of the tree rather than the number of entries. Each DirEntry carries the type and stat data the
+    listing provided (entry.stat() is cached after its first call). Directories are classified the way os.walk() does
+    it: a symlink to a directory is reported as a directory but not descended into. Directories that can't be listed
+    are skipped.
+
+    The filters are applied while walking, so excluded and too-deep directories are never listed at all. The others
+    only decide which entries are yielded: directories that fail them are still descended into.
+    @param ext: only entries with this extension, or one of this tuple of extensions (case insensitive, e.g. '.jpg')
+    @param glob: only entries whose name matches this fnmatch pattern (e.g. 'IMG_*.jpg')
+    @param max_depth: don't descend further than this; 1 yields only the entries directly in pathstring
+    @param exclude_dirs: names (or fnmatch patterns) of directories to neither yield nor descend into
+    @param min_size, max_size: only entries of at least / at most this many bytes (per lstat)
+    @param newer_than, older_than: only entries modified after / before this timestamp (seconds, like os.stat().st_mtime)
+    @param files, dirs: whether to yield files and directories at all
+    """
+    if isinstance(exclude_dirs, str):
+        exclude_dirs = (exclude_dirs,)
+    if ext is not None:
+        ext = tuple(e.lower() if e.startswith('.') else '.' + e.lower() for e in ((ext,) if isinstance(ext, str) else ext))
+    check_stat = any(x is not None for x in (min_size, max_size, newer_than, older_than))
+
+    def wanted(entry):
+        if ext is not None and not entry.name.lower().endswith(ext):
+            return False
+        if glob is not None and not fnmatch(entry.name, glob):
+            return False
+        if check_stat:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                return False
+            if min_size is not None and st.st_size < min_size or max_size is not None and st.st_size > max_size:
+                return False
+            if newer_than is not None and st.st_mtime <= newer_than or older_than is not None and st.st_mtime >= older_than:
+                return False
+        return True
+
+    if max_depth is not None and max_depth < 1:
+        return
+    try:
+        stack = [os.scandir(pathstring)]
+    except OSError:
+        return
+    try:
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:
+                stack.pop().close()
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                if files and wanted(entry):
+                    yield entry
+                continue
+            if any(fnmatch(entry.name, pattern) for pattern in exclude_dirs):
+                continue
+            if dirs and wanted(entry):
+                yield entry
+            if (max_depth is None or len(stack) < max_depth) and not entry.is_symlink():
+                try:
+                    stack.append(os.scandir(entry.path))
+                except OSError:
+                    pass
+    finally:
+        for it in stack:
+            it.close()
+
+
 def dup_rename(pathstring):
     """Return a path with an alternatively named last component (dirname/filename) 
     if pathstring already exists. Looks for an available path using the pattern name_#
+    - lists the directory on every call; use dup_rename_many() or a NameAllocator for many names in the same directory
     """
     if not opath.exists(pathstring):
         return pathstring
@@ -70,6 +243,93 @@ def dup_rename(pathstring):
             else:
                 suffix += 1
 
+def dup_rename_many(paths, reserve=False):
+    """dup_rename() for a batch of paths: return a list with a path for each one that is unique both against what's
+    on disk and against every earlier path in the batch, as if each name had been created before the next was
+    renamed. Each directory is listed once (see NameAllocator).
+    @param reserve: create each returned path right away (see NameAllocator)"""
+    allocators = {}
+    result = []
+    for pathstring in paths:
+        dirpath, name = opath.split(pathstring)
+        if dirpath not in allocators:
+            allocators[dirpath] = NameAllocator(dirpath, reserve)
+        result.append(allocators[dirpath].allocate(name))
+    return result
+
+
+class NameAllocator:
+    """
+    Hands out unique names in one directory following dup_rename()'s name_# pattern, listing the directory only once.
+
+    The names in the directory, and the ones already handed out, are kept in a set, along with the next suffix to try
+    for each name. Suffixes never have to be tried twice, so each allocation takes O(1) amortized instead of a listing
+    plus a scan through name_2, name_3, ... as with dup_rename(). As with dup_rename(), the smallest free suffix is used,
+    and a file's extension is kept at the end (name_2.txt) while directories are suffixed as a whole.
+
+    The listing goes stale if other processes add to the directory. With reserve=True every name is claimed on disk
+    as it's handed out (an empty file created with O_EXCL, or a directory with mkdir) and a name someone else got to
+    first is skipped, which makes allocation safe across processes. The caller then moves or writes its data over the
+    placeholder.
+
+    Example:
+        names = NameAllocator('/ingest/target')
+        for src in incoming:
+            os.rename(src, names.allocate(opath.basename(src)))
+    """
+    def __init__(self, dirpath, reserve=False):
+        self.dirpath = dirpath
+        self.reserve = reserve
+        self.taken = set()
+        self.files = set() # names in taken that are files, whose extensions are kept when they're suffixed
+        self.next_suffix = {}
+        try:
+            with os.scandir(dirpath or os.curdir) as it:
+                for entry in it:
+                    self.taken.add(entry.name)
+                    try:
+                        if entry.is_file():
+                            self.files.add(entry.name)
+                    except OSError:
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def allocate(self, name, is_dir=False):
+        """return the path of a free name in the directory: name itself, or name_# if that's taken.
+        @param is_dir: with reserve, create a directory rather than a file"""
+        while True:
+            candidate = self._candidate(name)
+            self.taken.add(candidate)
+            if not is_dir:
+                self.files.add(candidate)
+            path = opath.join(self.dirpath, candidate)
+            if not self.reserve or self._claim(path, is_dir):
+                return path
+
+    def _candidate(self, name):
+        if name not in self.taken:
+            return name
+        stem, ext = opath.splitext(name) if name in self.files else (name, '')
+        suffix = self.next_suffix.get((stem, ext), 2)
+        while f'{stem}_{suffix}{ext}' in self.taken:
+            suffix += 1
+        self.next_suffix[(stem, ext)] = suffix + 1
+        return f'{stem}_{suffix}{ext}'
+
+    @staticmethod
+    def _claim(path, is_dir):
+        """atomically create path; return False if it already exists"""
+        try:
+            if is_dir:
+                os.mkdir(path)
+            else:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+
 # Rewrite
 def is_danger_dir(pathstring):
     """Check whether the given directory is one of the large top lvl directories."""
@@ -93,20 +353,344 @@ def is_danger_dir(pathstring):
     return False
 
 
-def diff(dir1, dir2):
+def diff(dir1, dir2, cached=False, compare=None, workers=None):
     """compare two directory trees beginning at dir1 and dir2 respectively in order to find which dirs/files are unique to each tree.
     - returns a tuple like ([dir1_uniques],[dir2_uniques]) the list [dir1_uniques] contains the paths of all dirs/files that appear only in dir1. 
     - intended use is to compare two similar directory structures that more or less mirror each other but have minor differences. 
     - treats dir1 and dir2 as root directories and compares their members relative to those roots. i.e. "/some_path/dir1/subdir/filex" "/some_other_path/dir2/subdir/filex" are the same file. 
-    - pathstrings are compared, NOT file contents. 
+    - pathstrings are compared, NOT file contents, unless compare is given.
+    - if cached is True, the trees are listed from indexes kept between calls (see DirIndex.cached())
+    - if workers is given, file contents are hashed (compare='hash') on that many threads
+
+    @param compare: also check the files that appear in both trees, and return ([dir1_uniques], [dir2_uniques], [changed])
+        where [changed] holds a sorted (dir1_path, dir2_path) pair for every file that differs. One of:
+        - 'size': the sizes differ
+        - 'mtime': the sizes or modification times differ
+        - 'hash': the sizes or contents differ (contents are hashed with file_hash() on a thread pool)
+        A path that is a directory in one tree and a file in the other always counts as changed, and symlinks are
+        compared by their targets.
     """
-    # list all dirs/files and remove first part of their paths to facilitate str comparison later. 
-    sep = os.path.sep
-    ls1 = [ x.replace(dir1, '').lstrip(sep)    for x in    get_all_files(dir1, combined=True) ]
-    ls2 = [ x.replace(dir2, '').lstrip(sep)    for x in    get_all_files(dir2, combined=True) ]
+    if compare not in (None, 'size', 'mtime', 'hash'):
+        raise ValueError(f'compare must be None, \'size\', \'mtime\' or \'hash\', not {compare!r}')
+    rel1, rel2 = _relative_listing(dir1, cached), _relative_listing(dir2, cached)
     # find dirs files unique to each tree and add the first part of their path back on. 
-    u1 = sorted([ opath.join(dir1, x)    for x in    ls1     if x not in ls2])
-    u2 = sorted([ opath.join(dir2, x)    for x in    ls2     if x not in ls1])
-    return u1, u2
+    u1 = sorted([ opath.join(dir1, x)    for x in    rel1     if x not in rel2])
+    u2 = sorted([ opath.join(dir2, x)    for x in    rel2     if x not in rel1])
+    if compare is None:
+        return u1, u2
+
+    changed, unsure = [], []
+    for x, entry in rel1.items():
+        other = rel2.get(x)
+        if other is None:
+            continue
+        differs = _entry_differs(opath.join(dir1, x), opath.join(dir2, x), entry, other, compare)
+        if differs:
+            changed.append(x)
+        elif differs is None:
+            unsure.append(x)
+    if unsure:
+        with ThreadPoolExecutor(workers) as pool:
+            differs = pool.map(_contents_differ, [opath.join(dir1, x) for x in unsure], [opath.join(dir2, x) for x in unsure])
+            changed += [x for x, d in zip(unsure, differs) if d]
+    return u1, u2, sorted((opath.join(dir1, x), opath.join(dir2, x)) for x in changed)
+
+
+def _relative_listing(pathstring, cached=False):
+    """
+    for diff() and sync(): return {path relative to pathstring: (kind, size, mtime_ns)} for every dir/file below 
+    pathstring, in walk order, taken from a DirIndex so that comparing sizes and mtimes costs no further stats. kind is 
+    'dir', 'link', 'file' (a regular file) or 'other' (a device, pipe or socket). 
+
+    Only the leading pathstring is cut off each path, so a subdirectory that repeats the root's name further down is 
+    left alone.
+    """
+    index = DirIndex.cached(pathstring) if cached else DirIndex(pathstring)
+    sep = opath.sep
+    cut = len(pathstring)
+    listing = {}
+    for path, flags, size, mtime in zip(index.paths, index.flags, index.sizes, index.mtimes):
+        if flags & DirIndex.IS_SYMLINK:
+            kind = 'link'
+        elif flags & DirIndex.IS_DIR:
+            kind = 'dir'
+        elif flags & DirIndex.IS_FILE:
+            kind = 'file'
+        else:
+            kind = 'other'
+        listing[path[cut:].lstrip(sep)] = (kind, size, mtime)
+    return listing
+
+
+def _entry_differs(path1, path2, entry1, entry2, compare):
+    """
+    for diff() and sync(): whether the entries at path1 and path2, as listed by _relative_listing(), differ under the 
+    compare mode ('size', 'mtime' or 'hash'). Returns None when only their contents can tell, which is for 'hash' and two 
+    regular files of the same size (see _contents_differ()). 
+    """
+    kind = entry1[0]
+    if kind != entry2[0]:
+        return True
+    if kind == 'dir':
+        return False
+    if kind == 'link':
+        try:
+            return os.readlink(path1) != os.readlink(path2)
+        except OSError:
+            return True
+    if entry1[1] != entry2[1]:
+        return True
+    if compare == 'mtime':
+        return entry1[2] != entry2[2]
+    if compare == 'hash' and kind == 'file':
+        return None
+    return False
+
+
+def _contents_differ(path1, path2):
+    try:
+        return file_hash(path1) != file_hash(path2)
+    except OSError:
+        return True
+
+
+SyncPlan = namedtuple('SyncPlan', 'mkdirs copies deletes')
+
+
+def sync(src, dst, delete=False, dry_run=False, workers=None, compare='mtime'):
+    """
+    make the tree at dst a mirror of the tree at src, copying only what's new or changed.
+
+    Both trees are listed once (see DirIndex) and compared by relative path, then the resulting SyncPlan is carried
+    out: directories missing from dst are created, new and changed files are copied on a pool of threads, and the
+    metadata (permissions, times) of the copied files, and of the directories whose contents changed, is set from src.
+    File data is moved by the kernel where it can be (see _copy_contents()), so a large mirror is limited by the disks
+    rather than by Python. Symlinks are recreated as symlinks, never followed. If src isn't a directory that can be
+    listed, OSError is raised before anything in dst is touched.
+
+    @param delete: also delete whatever is in dst but not in src. A path that is a file on one side and a directory on
+        the other is replaced either way.
+    @param dry_run: only return the SyncPlan, touching nothing
+    @param workers: number of copying (and, for compare='hash', hashing) threads, None for the ThreadPoolExecutor default
+    @param compare: how a file present on both sides is checked for changes, as in diff(): 'size', 'mtime' (the size or
+        modification time differ, the default) or 'hash' (the size or contents differ)
+    @return: a SyncPlan(mkdirs, copies, deletes). mkdirs and deletes are paths in dst (deletes only the topmost path of
+        each deleted subtree), copies are (src_path, dst_path) pairs.
+    """
+    if compare not in ('size', 'mtime', 'hash'):
+        raise ValueError(f'compare must be \'size\', \'mtime\' or \'hash\', not {compare!r}')
+    # listing src raises if it can't be read, so a missing or mistyped src never looks like an empty tree whose mirror
+    # is deleted. dst may not exist yet.
+    listing1 = _relative_listing(src)
+    listing2 = _relative_listing(dst) if opath.lexists(dst) else {}
+    mkdirs, copies, removals, same_size = [], [], set(), []
+    for rel, entry in listing1.items():
+        kind = entry[0]
+        other = listing2.get(rel)
+        if other is not None and other[0] != kind:
+            removals.add(rel)
+            other = None
+        if kind == 'dir':
+            if other is None:
+                mkdirs.append(rel)
+        elif kind == 'other':
+            continue # devices, pipes and sockets aren't copied
+        elif other is None:
+            copies.append(rel)
+        else:
+            differs = _entry_differs(opath.join(src, rel), opath.join(dst, rel), entry, other, compare)
+            if differs:
+                copies.append(rel)
+            elif differs is None:
+                same_size.append(rel)
+    if delete:
+        removals.update(rel for rel in listing2 if rel not in listing1)
+
+    with ThreadPoolExecutor(workers) as pool:
+        if same_size:
+            differs = pool.map(_contents_differ, [opath.join(src, rel) for rel in same_size],
+                               [opath.join(dst, rel) for rel in same_size])
+            changed = {rel for rel, d in zip(same_size, differs) if d}
+            if changed:
+                changed.update(copies)
+                copies = [rel for rel in listing1 if rel in changed]
+        # listing2 is in walk order, so a directory always comes before its contents
+        deletes, removed = [], set()
+        for rel in listing2:
+            parent = opath.dirname(rel)
+            if rel in removals or parent in removed:
+                if parent not in removed:
+                    deletes.append(rel)
+                removed.add(rel)
+
+        plan = SyncPlan([opath.join(dst, rel) for rel in mkdirs],
+                        [(opath.join(src, rel), opath.join(dst, rel)) for rel in copies],
+                        [opath.join(dst, rel) for rel in deletes])
+        if not opath.isdir(dst):
+            plan.mkdirs.insert(0, dst)
+        if dry_run:
+            return plan
+
+        for path in plan.deletes:
+            if opath.isdir(path) and not opath.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        for path in plan.mkdirs:
+            os.makedirs(path, exist_ok=True)
+        for _ in pool.map(_copy_entry, plan.copies):
+            pass
+
+    # copy the directories' metadata last (and deepest first), since changing their contents changes their mtimes
+    touched = set(mkdirs)
+    touched.update(opath.dirname(rel) for rel in mkdirs + copies + deletes)
+    for rel in sorted(touched, key=lambda rel: rel.count(opath.sep) + bool(rel), reverse=True):
+        shutil.copystat(opath.join(src, rel), opath.join(dst, rel))
+    return plan
+
+
+def _copy_entry(pair):
+    """copy one file or symlink for sync(), with its metadata.
+
+    The copy is made under a temporary name next to dst_path and moved over it only once it's complete, so a failed
+    copy leaves the old file in place, and the old file's permissions (e.g. read-only, copied from the source by the
+    last sync) don't get in the way."""
+    src_path, dst_path = pair
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{opath.basename(dst_path)}.', suffix='.tmp', dir=opath.dirname(dst_path))
+    try:
+        if opath.islink(src_path):
+            os.close(fd)
+            os.remove(tmp_path)
+            os.symlink(os.readlink(src_path), tmp_path)
+        else:
+            with open(fd, 'wb') as fdst, open(src_path, 'rb') as fsrc:
+                _copy_contents(fsrc, fdst)
+        shutil.copystat(src_path, tmp_path, follow_symlinks=False)
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        if opath.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# errors from copy_file_range()/sendfile() meaning they can't handle this pair of files, rather than that the copy failed
+_NO_KERNEL_COPY = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.EPERM}
+
+
+def _copy_contents(fsrc, fdst):
+    """
+    copy the data of the binary file fsrc into the empty binary file fdst without passing it through Python where
+    possible: with os.copy_file_range(), which can also clone the data (btrfs, XFS) or copy it server side (NFS 4.2,
+    SMB), then with os.sendfile(), and otherwise with plain reads and writes.
+    """
+    infd, outfd = fsrc.fileno(), fdst.fileno()
+    blocksize = min(max(os.fstat(infd).st_size, 1<<23), 1<<30)
+    for kernel_copy in _KERNEL_COPIES:
+        offset = 0
+        try:
+            while True:
+                n = kernel_copy(infd, outfd, blocksize, offset)
+                if not n:
+                    return
+                offset += n
+        except OSError as e:
+            # only a method that fails before copying anything can be swapped for the next one
+            if offset or e.errno not in _NO_KERNEL_COPY:
+                raise
+    shutil.copyfileobj(fsrc, fdst, 1<<20)
+
+
+# (infd, outfd, count, offset) -> bytes copied from infd at offset to outfd at the same offset, best first
+_KERNEL_COPIES = []
+if hasattr(os, 'copy_file_range'):
+    _KERNEL_COPIES.append(lambda infd, outfd, count, offset: os.copy_file_range(infd, outfd, count, offset, offset))
+if hasattr(os, 'sendfile') and sys.platform.startswith('linux'): # elsewhere sendfile() can only write to a socket
+    # sendfile() writes at outfd's own position, which advances with every call
+    _KERNEL_COPIES.append(lambda infd, outfd, count, offset: os.sendfile(outfd, infd, offset, count))
+
+
+def find_duplicates(roots, min_size=1, partial_size=1<<12, workers=None, cached=False, algorithm='blake2b'):
+    """
+    find files with identical contents anywhere below roots.
+
+    Files are narrowed down in stages so that most are never read in full, or at all:
+    1. group by size (from the stat data of a DirIndex walk); a file with a unique size has no duplicate.
+    2. hash the first and last partial_size bytes of each file left.
+    3. hash the whole contents of the files still colliding, unless stage 2 already covered all of them.
+    The hashing runs on a thread pool. Hard links are recognised by (st_dev, st_ino): each inode is hashed once and
+    reported under the first path it was found at, since hard links share their storage rather than duplicating it.
+    Only regular files are considered (no symlinks, devices or pipes), and files that can't be read are skipped.
+
+    @param roots: a directory, or a list of directories
+    @param min_size: ignore files smaller than this many bytes (by default, empty files)
+    @param workers: number of hashing threads, None for the ThreadPoolExecutor default
+    @param cached: walk the roots through DirIndex.cached() instead of a fresh DirIndex
+    @param algorithm: any name hashlib.new() accepts
+    @return: a sorted list of groups, each a sorted list of the paths of 2 or more files with the same contents
+    """
+    if isinstance(roots, (str, bytes, os.PathLike)):
+        roots = [roots]
+    # 1. size buckets of {(device, inode): path}
+    by_size = {}
+    for root in roots:
+        index = DirIndex.cached(root) if cached else DirIndex(root)
+        for path, flags, size, inode, device in zip(index.paths, index.flags, index.sizes, index.inodes, index.devices):
+            if flags & DirIndex.IS_FILE and size >= min_size:
+                by_size.setdefault(size, {}).setdefault((device, inode), path)
+    candidates = [(size, path) for size, inodes in by_size.items() if len(inodes) > 1 for path in inodes.values()]
+
+    with ThreadPoolExecutor(workers) as pool:
+        # 2. partial hashes
+        groups = _group_by(pool, candidates, lambda size, path: _partial_hash(path, size, partial_size, algorithm))
+        # 3. full hashes, only where the partial hash didn't already read the whole file
+        full, rehash = [], []
+        for size, paths in groups:
+            if size <= 2 * partial_size:
+                full.append(paths)
+            else:
+                rehash += [(size, path) for path in paths]
+        full += [paths for _, paths in _group_by(pool, rehash, lambda size, path: file_hash(path, algorithm))]
+    return sorted(sorted(paths) for paths in full)
+
+
+def _group_by(pool, candidates, keyfn):
+    """for find_duplicates(): group (size, path) candidates by (size, keyfn(size, path)), computed on pool. Return
+    [(size, [paths])] for every group of 2 or more, dropping candidates whose keyfn raised OSError."""
+    def key(candidate):
+        try:
+            return keyfn(*candidate)
+        except OSError:
+            return None
+    groups = {}
+    for (size, path), digest in zip(candidates, pool.map(key, candidates)):
+        if digest is not None:
+            groups.setdefault((size, digest), []).append(path)
+    return [(size, paths) for (size, _), paths in groups.items() if len(paths) > 1]
+
+
+def _partial_hash(pathstring, size, partial_size, algorithm):
+    """hash the first and last partial_size bytes of a file (the whole file if it's no bigger than 2*partial_size)"""
+    h = hashlib.new(algorithm)
+    with open(pathstring, 'rb', buffering=0) as f:
+        h.update(f.read(partial_size))
+        if size > partial_size:
+            f.seek(max(partial_size, size - partial_size))
+            h.update(f.read(partial_size))
+    return h.digest()
+
+
+def file_hash(pathstring, algorithm='blake2b', bufsize=1<<20):
+    """return the hex digest of a file's contents, read in chunks of bufsize bytes.
+    @param algorithm: any name hashlib.new() accepts"""
+    h = hashlib.new(algorithm)
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    with open(pathstring, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
 
 
@@ -0,0 +1,29 @@
+import os
+import tempfile
+from jtools.jdir import jdir
+
+
+def test_sync_missing_source():
+    """a src that can't be listed must raise rather than look like an empty tree, whose mirror would be deleted"""
+    with tempfile.TemporaryDirectory() as root:
+        src, dst = os.path.join(root, 'src'), os.path.join(root, 'dst')
+        os.makedirs(os.path.join(src, 'sub'))
+        with open(os.path.join(src, 'sub', 'file'), 'w') as f:
+            f.write('x')
+        jdir.sync(src, dst, delete=True)
+        assert jdir.get_all_files(dst) == [[os.path.join(dst, 'sub')], [os.path.join(dst, 'sub', 'file')]]
+
+        for missing in (os.path.join(root, 'nope'), os.path.join(src, 'sub', 'file')):
+            for dry_run in (True, False):
+                try:
+                    jdir.sync(missing, dst, delete=True, dry_run=dry_run)
+                except OSError:
+                    pass
+                else:
+                    raise AssertionError(f'sync from {missing} did not raise')
+        assert jdir.get_all_files(dst) == [[os.path.join(dst, 'sub')], [os.path.join(dst, 'sub', 'file')]]
+
+
+if __name__ == '__main__':
+    test_sync_missing_source()
+    print('ok')
@@ -0,0 +1,330 @@
+"""live index of a directory tree kept current from inotify events (or by polling), so jdir queries don't rescan it"""
+import os
+import stat
+import time
+import errno
+import struct
+import os.path as opath
+from collections import namedtuple
+from jtools.jdir.ducache import stable_mtime
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _libc.inotify_init1, _libc.inotify_add_watch, _libc.inotify_rm_watch
+except (ImportError, OSError, AttributeError):
+    _libc = None
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_DONT_FOLLOW = 0x2000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+               IN_ONLYDIR | IN_DONT_FOLLOW)
+_EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len; followed by len bytes of NUL padded name
+
+
+Record = namedtuple('Record', 'is_dir is_symlink size inode')
+
+
+class TreeWatcher:
+    """
+    Index of a directory tree that follows changes to the tree instead of walking it again for every query.
+
+    The tree is walked once when the watcher is created. After that, on Linux, every directory carries an inotify
+    watch, and each query first applies the events that arrived since the last one: each event re-stats just the one
+    entry it names, and adds or drops whole subtrees when directories come or go. Where inotify isn't available or
+    its watch limit (fs.inotify.max_user_watches) runs out, the watcher polls instead: at most every poll_interval
+    seconds a query stats each directory and relists only the ones whose mtime changed. A file rewritten in place
+    doesn't change its directory's mtime, so in polling mode its new size shows up only once something else in that
+    directory changes.
+
+    The directory and file counts and the total size are kept as running sums, so those queries cost O(1) plus
+    O(events). The watcher has the attributes that jdir's index parameter expects, so the jdir functions can answer
+    from it directly. Like get_all_files(), symlinked directories count as directories but aren't descended into.
+
+    Whether a symlink counts as a directory depends on its target, and nothing is reported when the target changes,
+    so every symlink is classified again whenever a directory in the tree is added or removed. A symlink whose target is
+    outside the tree can still be misclassified until then, i.e. if its target directory is created or removed while
+    the tree stays the same.
+
+    Example:
+        with TreeWatcher('/srv/media') as watcher:
+            jdir.get_size('/srv/media', index=watcher)
+            jdir.get_file_count('/srv/media', index=watcher)
+    """
+    def __init__(self, root, poll_interval=5.0, use_inotify=True):
+        """
+        @param poll_interval: seconds between polls when inotify isn't used
+        @param use_inotify: False to always poll
+        """
+        self.root = root
+        self.poll_interval = poll_interval
+        self._fd = None
+        self._wds = {} # inotify watch descriptor -> directory path
+        self._dir_wds = {} # and back
+        if use_inotify and _libc is not None:
+            fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+        self._rebuild()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def inotify(self):
+        """True while the watcher follows inotify events, False once it polls"""
+        return self._fd is not None
+
+    def close(self):
+        """stop watching"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._wds.clear()
+        self._dir_wds.clear()
+
+    # queries
+
+    @property
+    def total_size(self):
+        """what jdir.get_size(root) would return"""
+        self.update()
+        return self._size
+
+    def file_count(self):
+        """return (num_dirs, num_files) like jdir.get_file_count()"""
+        self.update()
+        return (self._ndirs, self._nfiles)
+
+    def all_files(self):
+        """return [[subdirectories], [sub-files]] like jdir.get_all_files(). Entries of a directory come in the order they
+        were first seen, so this matches the os.walk() order only until the tree changes."""
+        self.update()
+        dirs, files = [], []
+        stack = [self.root]
+        while stack:
+            dirpath = stack.pop()
+            subdirs = []
+            for name, record in self._dirs.get(dirpath, {}).items():
+                path = opath.join(dirpath, name)
+                if record.is_dir:
+                    dirs.append(path)
+                    if path in self._dirs:
+                        subdirs.append(path)
+                else:
+                    files.append(path)
+            stack.extend(reversed(subdirs))
+        return [dirs, files]
+
+    def update(self):
+        """apply the changes made to the tree since the last update. Queries call this themselves."""
+        if self._fd is not None:
+            self._read_events()
+        elif time.monotonic() - self._last_poll >= self.poll_interval:
+            self._poll()
+        if self._dirs_changed:
+            self._refresh_symlinks()
+
+    # keeping the index current
+
+    def _rebuild(self):
+        for wd in list(self._wds):
+            self._unwatch(wd)
+        self._dirs = {} # directory path -> {name: Record} of its entries
+        self._dir_mtimes = {} # for polling
+        self._symlinks = set() # (directory path, name) of every symlink in the index
+        self._dirs_changed = False # a directory was added or removed since the symlinks were last classified
+        self._size, self._ndirs, self._nfiles = 0, 0, 0
+        self._last_poll = time.monotonic()
+        self._scan(self.root)
+
+    def _scan(self, top):
+        """add top and everything below it to the index"""
+        self._dirs_changed = True
+        stack = [top]
+        while stack:
+            dirpath = stack.pop()
+            self._watch(dirpath) # before listing it, so nothing created in between is missed
+            try:
+                self._dir_mtimes[dirpath] = stable_mtime(os.stat(dirpath).st_mtime_ns)
+                with os.scandir(dirpath) as it:
+                    entries = list(it)
+            except OSError:
+                self._unwatch(self._dir_wds.get(dirpath))
+                continue
+            self._dirs[dirpath] = {}
+            subdirs = []
+            for entry in entries:
+                record = _record(entry.path)
+                if record is None:
+                    continue
+                self._set(dirpath, entry.name, record)
+                if record.is_dir and not record.is_symlink:
+                    subdirs.append(entry.path)
+            stack.extend(reversed(subdirs))
+
+    def _drop(self, top):
+        """remove top and everything below it from the index"""
+        self._dirs_changed = True
+        stack = [top]
+        while stack:
+            dirpath = stack.pop()
+            listing = self._dirs.pop(dirpath, None)
+            self._dir_mtimes.pop(dirpath, None)
+            self._unwatch(self._dir_wds.get(dirpath))
+            if listing is None:
+                continue
+            for name, record in listing.items():
+                self._count(record, -1)
+                if record.is_symlink:
+                    self._symlinks.discard((dirpath, name))
+                elif record.is_dir:
+                    stack.append(opath.join(dirpath, name))
+
+    def _refresh(self, dirpath, name):
+        """bring the entry name of dirpath up to date with the filesystem"""
+        listing = self._dirs.get(dirpath)
+        if listing is None:
+            return
+        path = opath.join(dirpath, name)
+        old = listing.get(name)
+        new = _record(path)
+        if old is not None and path in self._dirs:
+            # the directory indexed at path is gone, or another one was moved into its place
+            if new is None or not new.is_dir or new.is_symlink or new.inode != old.inode:
+                self._drop(path)
+        self._set(dirpath, name, new)
+        if new is not None and new.is_dir and not new.is_symlink and path not in self._dirs:
+            self._scan(path)
+
+    def _set(self, dirpath, name, record):
+        listing = self._dirs[dirpath]
+        old = listing.pop(name, None) if record is None else listing.get(name)
+        if old is not None:
+            self._count(old, -1)
+            if old.is_symlink:
+                self._symlinks.discard((dirpath, name))
+        if record is not None:
+            listing[name] = record
+            self._count(record, 1)
+            if record.is_symlink:
+                self._symlinks.add((dirpath, name))
+
+    def _refresh_symlinks(self):
+        """classify every symlink again, since directories their targets point at may have come or gone"""
+        self._dirs_changed = False
+        for dirpath, name in list(self._symlinks):
+            self._refresh(dirpath, name)
+
+    def _count(self, record, sign):
+        if record.is_dir:
+            self._ndirs += sign
+        else:
+            self._nfiles += sign
+        if not record.is_symlink:
+            self._size += sign * record.size
+
+    # inotify
+
+    def _watch(self, dirpath):
+        if self._fd is None:
+            return
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(dirpath), _WATCH_MASK)
+        if wd >= 0:
+            self._wds[wd] = dirpath
+            self._dir_wds[dirpath] = wd
+            return
+        err = ctypes.get_errno()
+        if err in (errno.ENOSPC, errno.ENOMEM): # out of watches: fall back to polling from here on
+            self.close()
+
+    def _unwatch(self, wd, rm_watch=True):
+        if wd is None:
+            return
+        dirpath = self._wds.pop(wd, None)
+        if self._dir_wds.get(dirpath) == wd:
+            del self._dir_wds[dirpath]
+        if rm_watch and self._fd is not None:
+            _libc.inotify_rm_watch(self._fd, wd)
+
+    def _read_events(self):
+        changed = []
+        while self._fd is not None:
+            try:
+                data = os.read(self._fd, 1<<16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    self._rebuild()
+                    return
+                if mask & IN_IGNORED: # the kernel dropped the watch (its directory was deleted, or inotify_rm_watch)
+                    self._unwatch(wd, rm_watch=False)
+                    continue
+                dirpath = self._wds.get(wd)
+                if dirpath is not None and name:
+                    changed.append((dirpath, name))
+        for dirpath, name in dict.fromkeys(changed):
+            self._refresh(dirpath, name)
+        for dirpath in dict.fromkeys(dirpath for dirpath, _ in changed):
+            self._refresh_dir_entry(dirpath)
+        if self._fd is None and changed: # ran out of watches while applying them
+            self._poll()
+
+    def _refresh_dir_entry(self, dirpath):
+        """a directory's own size changes as entries come and go, and it's recorded in its parent"""
+        if dirpath != self.root:
+            self._refresh(opath.dirname(dirpath), opath.basename(dirpath))
+
+    # polling
+
+    def _poll(self):
+        self._last_poll = time.monotonic()
+        for dirpath in list(self._dirs):
+            if dirpath not in self._dirs: # dropped along with a parent earlier in this poll
+                continue
+            try:
+                mtime = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime is None or mtime == self._dir_mtimes.get(dirpath):
+                continue # (if it's gone, its parent changed too, and drops it)
+            self._dir_mtimes[dirpath] = stable_mtime(mtime)
+            try:
+                names = os.listdir(dirpath)
+            except OSError:
+                continue
+            for name in list(dict.fromkeys(list(self._dirs[dirpath]) + names)):
+                self._refresh(dirpath, name)
+            self._refresh_dir_entry(dirpath)
+
+
+def _record(path):
+    """lstat path into a Record, or None if it's gone"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    is_symlink = stat.S_ISLNK(st.st_mode)
+    is_dir = opath.isdir(path) if is_symlink else stat.S_ISDIR(st.st_mode)
+    return Record(is_dir, is_symlink, st.st_size, st.st_ino)
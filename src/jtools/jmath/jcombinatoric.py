@@ -1,6 +1,17 @@
+import math
+import os
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, reduce as fold
+from operator import itemgetter
 from jtools.jconsole import test, red, yellow, blue
+try:
+    import numpy as np
+except ImportError: # optional, only needed for as_array=True
+    np = None
 
-def combinations_by_index(n, r, offset=0):
+def combinations_by_index(n, r, offset=0, as_array=False):
     """
     Return a list of all possible r-length combinations of the INDICES in a hypothetical n-length list. These are combinations without replacement.
     
@@ -14,9 +25,15 @@ def combinations_by_index(n, r, offset=0):
     @param n: length of a subscriptable object (str, list, tuple...etc)
     @param r: size of samples
     @param offset: used internally 
+    @param as_array: return a contiguous (count, r) NumPy array of the smallest unsigned int type that holds n-1 instead 
+        of a list of lists, so that callers can gather values with items_array[combos] directly. Requires NumPy. 
     """
     if n < r: # not possible, i.e. 5choose8
         raise ValueError
+    if as_array:
+        return _combinations_array(n, r)
+    if r == 0: # the one empty combination, as for count_combinations(n, 0)
+        return [[]]
     if r == 1:
         return [[x] for x in range(offset, n)]
     else:
@@ -26,7 +43,7 @@ def combinations_by_index(n, r, offset=0):
             perms.extend([[i] + x for x in sub_combos])
         return perms
     
-def combinations(items, r):
+def combinations(items, r, multiset=False):
     """
     Return a list of all possible r-length combinations of the elements in "items". These are "combinations without replacement". 
 
@@ -34,11 +51,15 @@ def combinations(items, r):
 
     Combinations ignore ordering, so 'ab' and 'ba' are not considered distinct combinations in the string 'abhor'.
     However if elements repeat themselves within "items" such as in the string 'antenna', then 'an' and 'na' are 
-    legitimately distinct combinations and will both be included.  
+    legitimately distinct combinations and will both be included, unless multiset is True.  
 
     @param items: a subscriptable object (str, list, tuple...etc)
     @param r: length of combinations 
+    @param multiset: treat equal elements as interchangeable and return each distinct grouping of values once, see 
+        iter_multiset_combinations(). 
     """
+    if multiset:
+        return [combo if isinstance(items, str) else list(combo) for combo in iter_multiset_combinations(items, r)]
     # mapping the indices returned by combinations_by_index() to the values in "items" 
     # avoids a copy of the "items" object being created for each level of recursion. 
     index_combos = combinations_by_index(len(items), r) 
@@ -48,39 +69,188 @@ def combinations(items, r):
         value_combos = [[items[i] for i in combo] for combo in index_combos]
     return value_combos    
 
+def iter_combinations_by_index(n, r, start=0, stop=None):
+    """
+    Generator version of combinations_by_index(). Yields the same combinations of indices, in the same order, as tuples.
+
+    Only the current combination is kept in memory. Each step finds the rightmost index that can still be advanced, 
+    advances it, and resets every index after it to the smallest values that follow, which is the order the recursion in
+    combinations_by_index() produces. 
+
+    @param n: length of a subscriptable object (str, list, tuple...etc)
+    @param r: size of samples
+    @param start: rank (position in combinations_by_index()) of the first combination to yield. It is found with 
+        unrank_combination(), so skipping ahead costs O(n) rather than generating everything before it. 
+    @param stop: rank at which to stop (exclusive). None means run to the end. 
+    """
+    if n < r: # not possible, i.e. 5choose8
+        raise ValueError
+    total = math.comb(n, r)
+    stop = total if stop is None else min(stop, total)
+    if start >= stop:
+        return
+    indices = unrank_combination(n, r, start)
+    yield tuple(indices)
+    for _ in range(stop - start - 1):
+        for i in reversed(range(r)):
+            if indices[i] != i + n - r:
+                break
+        indices[i] += 1
+        for j in range(i+1, r):
+            indices[j] = indices[j-1] + 1
+        yield tuple(indices)
+
+def iter_combinations(items, r, start=0, stop=None, multiset=False):
+    """
+    Generator version of combinations(). Yields the same combinations, in the same order, one at a time so that callers 
+    that filter or stop early only pay for what they read.
+
+    If items is a string strings are yielded. Otherwise tuples are yielded.
+
+    @param items: a subscriptable object (str, list, tuple...etc)
+    @param r: length of combinations 
+    @param start, stop: only yield the combinations ranked start to stop-1, see iter_combinations_by_index()
+    @param multiset: see combinations(). Ranks don't apply to multiset combinations, so start and stop can't be used with it.
+    """
+    if multiset:
+        if start != 0 or stop is not None:
+            raise ValueError('start and stop are not supported for multiset combinations')
+        yield from iter_multiset_combinations(items, r)
+        return
+    for combo in iter_combinations_by_index(len(items), r, start, stop):
+        if isinstance(items, str):
+            yield ''.join([items[i] for i in combo])
+        else:
+            yield tuple([items[i] for i in combo])
+
 def orderings(items):
     """convenience function"""
     return permutations(items, len(items))
 
-def orderings_by_index(n, index_set=None):
+def orderings_by_index(n, index_set=None, as_array=False):
     """
     return a list of all possible orderings of the INDICES in a hypothetical n-length list. 
 
     These indices may later be mapped to the values in an actual n-length list or other subscriptable object to produce the list
     of all possible orderings of the items in that subscriptable. 
+
+    @param index_set: order these values instead of range(n). The orderings come out in lexicographic order of the 
+        positions in index_set, so [2, 0, 1] starts with [2, 0, 1], [2, 1, 0], [0, 2, 1]. 
+    @param as_array: return a contiguous (n!, n) NumPy array instead of a list of lists, see combinations_by_index(). With
+        index_set, the array has NumPy's type for those values.
     """
+    if as_array and index_set is None:
+        return _orderings_array(n)
     
     if index_set is None:
         index_set = list(range(n))
-    
-    length = len(index_set)
-    # included for completeness, even though I shouldn't be asking for the orderings of a single item list. 
-    if length == 1:
-        return [[0]]
-    # recursive base case is trivial case of all orderings of the last two indices of a list.
-    elif length == 2:
-        return [[index_set[0], index_set[1]], [index_set[1], index_set[0]]]
     else:
-        orderings = []
-        # Pick one element, set it at the first position. Combine it with all possible orderings of the remaining subset of elements. 
-        for i in index_set:
-            subset = index_set.copy()
-            subset.remove(i)
-            orderings.extend([[i] + x for x in orderings_by_index(n, subset)])
-        
-    return orderings
+        index_set = list(index_set)
+    if as_array:
+        # the same orderings of positions, gathered from the values
+        table = _orderings_array(len(index_set))
+        return np.array(index_set, dtype=None if index_set else table.dtype)[table]
+    if all(a < b for a, b in zip(index_set, index_set[1:])):
+        # ascending and distinct, so the lexicographic order of the values is that of their positions
+        return [list(o) for o in _iter_orderings(index_set)]
+    getter = index_set.__getitem__
+    return [list(map(getter, o)) for o in _iter_orderings(list(range(len(index_set))))]
+
+def iter_orderings_by_index(n, reuse_buffer=False):
+    """
+    Generator version of orderings_by_index(). Yields the same orderings of indices, in the same order, as tuples.
 
-def permutations_by_index(n, r):
+    @param reuse_buffer: yield the same list object every time, rearranged in place by swapping its elements, instead of 
+        a new tuple per ordering. Nothing is allocated per ordering, but the list is overwritten by the next step, so it 
+        must be used (or copied) before asking for the next one. 
+    """
+    return _iter_orderings(list(range(n)), reuse_buffer)
+
+def _iter_orderings(values, reuse_buffer=False):
+    """
+    Generator that yields every ordering of the ascending list of distinct values in lexicographic order, mutating the
+    values list itself. An empty list has one ordering, the empty one.
+
+    The list is stepped to its next permutation in place: find the rightmost position whose value is smaller than the 
+    one after it, swap it with the smallest bigger value to its right, then reverse everything after that position. 
+    Doing that in Python for every ordering is slow, so it is only done for the leading positions. The last few 
+    positions (_TAIL_LENGTH at most) are always sorted at that point, and all of their orderings are emitted in one go:
+    as tuples built in C by precomputed itemgetters, or with reuse_buffer, by applying the precomputed swaps that step 
+    the tail through its orderings to the values list itself. 
+    """
+    n = len(values)
+    if n == 0:
+        yield values if reuse_buffer else ()
+        return
+    tail = min(n, _TAIL_LENGTH)
+    head = n - tail
+    order = values
+    if reuse_buffer:
+        steps = _tail_swaps(tail, head)
+    else:
+        getters = _tail_getters(tail)
+    while True:
+        if reuse_buffer:
+            yield order
+            for step in steps:
+                for a, b in step:
+                    order[a], order[b] = order[b], order[a]
+                yield order
+        else:
+            suffix = order[head:]
+            prefix = tuple(order[:head])
+            for getter in getters:
+                yield prefix + getter(suffix)
+            order[head:] = suffix[::-1]
+        # The tail has been through all its orderings and ends on its last one, descending. Step the whole list to its
+        # next permutation, which changes the head and leaves the tail sorted again.
+        i = head - 1
+        while i >= 0 and order[i] > order[i+1]:
+            i -= 1
+        if i < 0:
+            return
+        j = n - 1
+        while order[j] < order[i]:
+            j -= 1
+        order[i], order[j] = order[j], order[i]
+        order[i+1:] = reversed(order[i+1:])
+
+@lru_cache(maxsize=None)
+def _tail_getters(length):
+    """return one callable per ordering of a length-item sequence, in lexicographic order, each taking the sequence and 
+    returning it rearranged by that ordering as a tuple."""
+    if length == 1:
+        return (lambda s: (s[0],),)
+    return tuple(itemgetter(*unrank_ordering(length, k)) for k in range(math.factorial(length)))
+
+@lru_cache(maxsize=None)
+def _tail_swaps(length, offset):
+    """return, for each step from one ordering of a length-item tail to the next in lexicographic order, the pairs of 
+    positions (counted from offset) to swap. Each step is the usual next-permutation: one swap, then the reversal of 
+    everything after the swapped position, done as swaps too."""
+    order = list(range(length))
+    steps = []
+    for _ in range(math.factorial(length) - 1):
+        i = length - 2
+        while order[i] > order[i+1]:
+            i -= 1
+        j = length - 1
+        while order[j] < order[i]:
+            j -= 1
+        step = [(i, j)]
+        a, b = i + 1, length - 1
+        while a < b:
+            step.append((a, b))
+            a, b = a + 1, b - 1
+        for a, b in step:
+            order[a], order[b] = order[b], order[a]
+        steps.append(tuple((offset + a, offset + b) for a, b in step))
+    return tuple(steps)
+
+# number of trailing positions whose orderings _iter_orderings() emits from precomputed itemgetters or swaps (5! = 120)
+_TAIL_LENGTH = 5
+
+def permutations_by_index(n, r, as_array=False):
     """
     Return a list of all possible r-length permutations of the INDICES in a hypothetical n-length list. These are permutations without replacement.
     
@@ -91,22 +261,24 @@ def permutations_by_index(n, r):
 
     @param n: length of a subscriptable object (str, list, tuple...etc)
     @param r: size of samples
+    @param as_array: return a contiguous (count, r) NumPy array instead of a list of lists, see combinations_by_index()
     """    
+    if as_array:
+        if n < r:
+            raise ValueError
+        # row c*r! + o is combination c rearranged by ordering o, matching the list version below
+        combos = _combinations_array(n, r)
+        orders = _orderings_array(r)
+        return np.ascontiguousarray(combos[:, orders].reshape(len(combos) * len(orders), r))
 
-    # find all orderings of a r indices. 
-    orderings = orderings_by_index(r)
-    # when n==r permutations simplifies to all the ORDERINGS of the items in the list. No need to find rlength combinations first. 
-    if n == r:
-        return orderings
-    combinations = combinations_by_index(n, r)
-    
+    # every ordering of each combination. The combinations are ascending, so ordering them lexicographically by value 
+    # gives the same order as applying orderings_by_index(r) to them.
     permutations = []
-    for x in combinations:
-        for o in orderings:
-            permutations.extend([[x[i] for i in o]])
+    for x in iter_combinations_by_index(n, r):
+        permutations.extend([o[:] for o in _iter_orderings(list(x), reuse_buffer=True)])
     return permutations
     
-def permutations(items, r):
+def permutations(items, r, multiset=False):
     """
     Return a list of all possible r-length permutations of the elements in "items". These are "permutations without replacement". 
 
@@ -116,7 +288,11 @@ def permutations(items, r):
 
     @param items: a subscriptable object (str, list, tuple...etc)
     @param r: length of permutations 
+    @param multiset: treat equal elements as interchangeable and return each distinct arrangement of values once, see
+        iter_multiset_permutations(). 
     """
+    if multiset:
+        return [perm if isinstance(items, str) else list(perm) for perm in iter_multiset_permutations(items, r)]
     index_perms = permutations_by_index(len(items), r) 
     if isinstance(items, str):
         value_perms = [''.join([items[i] for i in perm]) for perm in index_perms]
@@ -124,6 +300,346 @@ def permutations(items, r):
         value_perms = [[items[i] for i in perm] for perm in index_perms]
     return value_perms    
 
+def iter_permutations_by_index(n, r, reuse_buffer=False):
+    """
+    Generator version of permutations_by_index(). Yields the same permutations of indices, in the same order, as tuples.
+
+    @param n: length of a subscriptable object (str, list, tuple...etc)
+    @param r: size of samples
+    @param reuse_buffer: yield one list rearranged in place instead of new tuples, see iter_orderings_by_index()
+    """
+    for combo in iter_combinations_by_index(n, r):
+        yield from _iter_orderings(list(combo), reuse_buffer)
+
+def iter_permutations(items, r, multiset=False):
+    """
+    Generator version of permutations(). Yields the same permutations, in the same order, one at a time so that callers 
+    that filter or stop early only pay for what they read.
+
+    If items is a string strings are yielded. Otherwise tuples are yielded.
+
+    @param items: a subscriptable object (str, list, tuple...etc)
+    @param r: length of permutations 
+    @param multiset: see permutations()
+    """
+    if multiset:
+        yield from iter_multiset_permutations(items, r)
+        return
+    for perm in iter_permutations_by_index(len(items), r):
+        if isinstance(items, str):
+            yield ''.join([items[i] for i in perm])
+        else:
+            yield tuple([items[i] for i in perm])
+
+
+def multiset_counts(items):
+    """
+    return (values, counts): the distinct elements of items in order of first appearance, and how many times each occurs. 
+    e.g. 'antenna' -> (['a', 'n', 't', 'e'], [2, 3, 1, 1])
+
+    Unhashable elements (lists...etc) are compared by equality instead of hashing.
+    """
+    values, counts, position = [], [], {}
+    for x in items:
+        try:
+            i = position.setdefault(x, len(values))
+        except TypeError:
+            i = next((j for j, v in enumerate(values) if v == x), len(values))
+        if i == len(values):
+            values.append(x)
+            counts.append(0)
+        counts[i] += 1
+    return values, counts
+
+def iter_multiset_combinations_by_index(counts, r):
+    """
+    Generator that yields every distinct r-length combination drawn from a multiset, as a non-decreasing tuple of value 
+    indices. Value i may appear up to counts[i] times. Combinations come in lexicographic order, each exactly once, and 
+    duplicates are never generated in the first place.
+
+    Think of the multiset spelled out as a sorted pool, e.g. counts [2, 3, 1] -> pool [0, 0, 1, 1, 1, 2]. Each step finds 
+    the rightmost position that can still take a bigger value, moves it to the next distinct value, and refills everything 
+    after it with the pool's run starting at that value's first occurrence. 
+    """
+    pool = [i for i, c in enumerate(counts) for _ in range(c)]
+    if len(pool) < r: # not possible, i.e. 5choose8
+        raise ValueError
+    combo = pool[:r]
+    yield tuple(combo)
+    while True:
+        for i in reversed(range(r)):
+            if combo[i] < pool[len(pool) - r + i]:
+                break
+        else:
+            return
+        start = bisect_right(pool, combo[i])
+        combo[i:] = pool[start:start + r - i]
+        yield tuple(combo)
+
+def iter_multiset_combinations(items, r):
+    """
+    Generator that yields every distinct r-length grouping of the values in items once, treating equal elements as 
+    interchangeable. For 'antenna', 'an' is yielded but 'na' is not, and 'nn' is yielded once rather than three times. 
+    Values appear in order of their first appearance in items.
+
+    If items is a string strings are yielded. Otherwise tuples are yielded.
+    """
+    values, counts = multiset_counts(items)
+    for combo in iter_multiset_combinations_by_index(counts, r):
+        if isinstance(items, str):
+            yield ''.join([values[i] for i in combo])
+        else:
+            yield tuple([values[i] for i in combo])
+
+def iter_multiset_permutations(items, r):
+    """
+    Generator that yields every distinct r-length arrangement of the values in items once, treating equal elements as 
+    interchangeable. For 'antenna' and r=3, 'nna' is yielded once rather than once per pair of n's.
+
+    Like permutations(), the arrangements are grouped by combination: every distinct ordering of the first multiset 
+    combination, then of the second, and so on. Within a combination the orderings come in lexicographic order, stepped 
+    with the usual next-permutation algorithm, which never produces a repeat when values are equal. 
+
+    If items is a string strings are yielded. Otherwise tuples are yielded.
+    """
+    values, counts = multiset_counts(items)
+    for combo in iter_multiset_combinations_by_index(counts, r):
+        order = list(combo)
+        while True:
+            if isinstance(items, str):
+                yield ''.join([values[i] for i in order])
+            else:
+                yield tuple([values[i] for i in order])
+            i = r - 2
+            while i >= 0 and order[i] >= order[i+1]:
+                i -= 1
+            if i < 0:
+                break
+            j = r - 1
+            while order[j] <= order[i]:
+                j -= 1
+            order[i], order[j] = order[j], order[i]
+            order[i+1:] = reversed(order[i+1:])
+
+def _index_dtype(n):
+    """smallest unsigned NumPy int type that can hold the indices of an n-length list."""
+    return np.min_scalar_type(max(n - 1, 0))
+
+def _combinations_array(n, r):
+    """
+    Build combinations_by_index(n, r) as a (count, r) NumPy array without any per-row Python work.
+
+    The table is built up one column count at a time. Listed in order, the k-length combinations that start with index i
+    are i followed by each (k-1)-length combination made from the indices after i, and those (k-1)-length combinations 
+    are exactly the last comb(n-1-i, k-1) rows of the (k-1)-column table. So each new table is a repeat of the first 
+    indices next to one gather of tail rows from the previous table.
+    """
+    if np is None:
+        raise ImportError('as_array=True requires numpy')
+    dtype = _index_dtype(n)
+    if r == 0:
+        return np.zeros((1, 0), dtype=dtype)
+    table = np.arange(n, dtype=dtype).reshape(-1, 1)
+    for k in range(2, r + 1):
+        firsts = np.arange(n - k + 1)
+        counts = np.array([math.comb(n - 1 - i, k - 1) for i in firsts], dtype=np.int64)
+        block_starts = np.cumsum(counts) - counts
+        total = int(counts.sum())
+        # position of each new row within its block, and the tail of the old table that block draws from
+        within = np.arange(total, dtype=np.int64) - np.repeat(block_starts, counts)
+        rows = np.repeat(len(table) - counts, counts) + within
+        new = np.empty((total, k), dtype=dtype)
+        new[:, 0] = np.repeat(firsts, counts)
+        new[:, 1:] = table[rows]
+        table = new
+    return table
+
+def _orderings_array(n):
+    """
+    Build orderings_by_index(n) as an (n!, n) NumPy array.
+
+    The orderings that start with i are i followed by every ordering of the remaining indices, which is the (n-1)-index
+    table with every value >= i shifted up by one. 
+    """
+    if np is None:
+        raise ImportError('as_array=True requires numpy')
+    dtype = _index_dtype(n)
+    table = np.zeros((1, 0), dtype=dtype)
+    for k in range(1, n + 1):
+        blocks = []
+        for i in range(k):
+            block = np.empty((len(table), k), dtype=dtype)
+            block[:, 0] = i
+            block[:, 1:] = table + (table >= i)
+            blocks.append(block)
+        table = np.concatenate(blocks)
+    return table
+
+def count_combinations(n, r):
+    """return the number of r-length combinations of n items, i.e. len(combinations_by_index(n, r)), without building them."""
+    return math.comb(n, r)
+
+def count_permutations(n, r):
+    """return the number of r-length permutations of n items, i.e. len(permutations_by_index(n, r)), without building them."""
+    return math.perm(n, r)
+
+def unrank_combination(n, r, k):
+    """
+    return combinations_by_index(n, r)[k] without building the list of combinations. 
+
+    The combination is built one position at a time: every choice of index x at the current position accounts for a 
+    known block of combinations (those made from the indices after x), so whole blocks are skipped until the one holding
+    k is reached. That takes at most n steps. 
+
+    @param n: length of a subscriptable object (str, list, tuple...etc)
+    @param r: size of samples
+    @param k: rank of the combination, 0 <= k < count_combinations(n, r)
+    """
+    if not 0 <= k < math.comb(n, r):
+        raise IndexError(f'combination rank {k} out of range for n={n}, r={r}')
+    combo = []
+    x = 0
+    for i in range(r):
+        while True:
+            block = math.comb(n - x - 1, r - i - 1)
+            if k < block:
+                break
+            k -= block
+            x += 1
+        combo.append(x)
+        x += 1
+    return combo
+
+def rank_combination(combo, n):
+    """
+    return the position of combo within combinations_by_index(n, len(combo)). This is the inverse of unrank_combination().
+
+    @param combo: ascending sequence of indices
+    @param n: length of the subscriptable object the indices refer to. The ordering depends on it, so it has to be given.
+    """
+    r = len(combo)
+    rank = 0
+    x = 0
+    for i, c in enumerate(combo):
+        for skipped in range(x, c):
+            rank += math.comb(n - skipped - 1, r - i - 1)
+        x = c + 1
+    return rank
+
+def unrank_ordering(n, k):
+    """return orderings_by_index(n)[k] without building the list of orderings."""
+    if not 0 <= k < math.factorial(n):
+        raise IndexError(f'ordering rank {k} out of range for n={n}')
+    remaining = list(range(n))
+    ordering = []
+    for i in range(n, 0, -1):
+        q, k = divmod(k, math.factorial(i - 1))
+        ordering.append(remaining.pop(q))
+    return ordering
+
+def rank_ordering(ordering):
+    """return the position of ordering within orderings_by_index(len(ordering)). This is the inverse of unrank_ordering()."""
+    n = len(ordering)
+    rank = 0
+    for i, x in enumerate(ordering):
+        smaller_after = sum(1 for y in ordering[i+1:] if y < x)
+        rank += smaller_after * math.factorial(n - i - 1)
+    return rank
+
+def unrank_permutation(n, r, k):
+    """
+    return permutations_by_index(n, r)[k] without building the list of permutations. 
+
+    permutations_by_index() lists every ordering of the first combination, then every ordering of the second and so on, 
+    so k splits into the rank of a combination and the rank of an ordering of it. 
+
+    @param n: length of a subscriptable object (str, list, tuple...etc)
+    @param r: size of samples
+    @param k: rank of the permutation, 0 <= k < count_permutations(n, r)
+    """
+    if not 0 <= k < math.perm(n, r):
+        raise IndexError(f'permutation rank {k} out of range for n={n}, r={r}')
+    combo_rank, ordering_rank = divmod(k, math.factorial(r))
+    combo = unrank_combination(n, r, combo_rank)
+    return [combo[i] for i in unrank_ordering(r, ordering_rank)]
+
+def rank_permutation(perm, n):
+    """
+    return the position of perm within permutations_by_index(n, len(perm)). This is the inverse of unrank_permutation().
+
+    @param perm: sequence of distinct indices
+    @param n: length of the subscriptable object the indices refer to. The ordering depends on it, so it has to be given.
+    """
+    combo = sorted(perm)
+    position = {x: i for i, x in enumerate(combo)}
+    ordering = [position[x] for x in perm]
+    return rank_combination(combo, n) * math.factorial(len(perm)) + rank_ordering(ordering)
+
+
+def map_combinations(fn, items, r, workers=None, chunksize=None, reduce=None):
+    """
+    Apply fn to every r-length combination of items (as yielded by iter_combinations()) using a pool of processes. 
+
+    The rank space 0..count_combinations() is split into contiguous chunks. Each worker receives items once, then for
+    each chunk generates its combinations itself (starting from an unranked first combination) and applies fn, so the
+    combinations are never pickled. Results come back in rank order regardless of which worker finishes first. 
+
+    Returns a generator of fn's results. If reduce is given, it is instead used to fold the results (each worker folds its 
+    own chunk first, then the chunk results are folded in rank order) and the single folded value is returned.
+    e.g. map_combinations(score, items, 5, reduce=max)
+
+    fn and reduce are sent to the workers, so they have to be picklable, i.e. defined at module level.
+
+    @param fn: function taking one combination
+    @param items: a subscriptable object (str, list, tuple...etc)
+    @param r: length of combinations 
+    @param workers: number of processes, defaults to the number of CPUs
+    @param chunksize: number of combinations per chunk. Defaults to enough chunks for a few per worker, capped so that 
+        results stream back steadily.
+    @param reduce: function of two arguments, like the one functools.reduce takes
+    """
+    if len(items) < r: # not possible, i.e. 5choose8
+        raise ValueError
+    total = math.comb(len(items), r)
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, min(total // (workers * 4) + 1, 1 << 16))
+    chunks = ((start, min(start + chunksize, total)) for start in range(0, total, chunksize))
+    results = _map_chunks(chunks, workers, (fn, items, r, reduce))
+    if reduce is None:
+        return (result for chunk in results for result in chunk)
+    return fold(reduce, results)
+
+def _map_chunks(chunks, workers, job):
+    """
+    Generator that runs _map_chunk() on each chunk in a process pool and yields the chunk results in order. Only a few
+    chunks per worker are in flight at a time, so a slow consumer doesn't make results pile up in memory. 
+    """
+    with ProcessPoolExecutor(workers, initializer=_init_map_worker, initargs=job) as pool:
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(pool.submit(_map_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def _init_map_worker(fn, items, r, reduce):
+    """process pool initializer: send the job to each worker once instead of with every chunk."""
+    global _map_job
+    _map_job = (fn, items, r, reduce)
+
+def _map_chunk(bounds):
+    fn, items, r, reduce = _map_job
+    results = map(fn, iter_combinations(items, r, bounds[0], bounds[1]))
+    if reduce is None:
+        return list(results)
+    return fold(reduce, results)
+
 
 if __name__ == '__main__':
 
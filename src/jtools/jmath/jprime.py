@@ -1,115 +1,782 @@
+import gc
 import math
 import itertools
+import mmap
+import os
+import random
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError: # windows
+    fcntl = None
+try:
+    import numpy as np
+except ImportError: # optional, only isprime_array() and factorize_many() use it
+    np = None
 
 class JPrime():
     """
     Class that stores a list of primes and extends it using Erotasthenes' Sieve.
+
+    The primes are kept in self.primes, a typed array of unsigned 64-bit ints that is always sorted and free of duplicates,
+    so lookups into it are binary searches rather than scans. 
+
+    The table can live in a file instead (see the path parameter and save()). The file is memory-mapped, so any number of
+    processes using the same file share one copy of the primes, and a new JPrime starts from everything that was sieved
+    before instead of from [2, 3]. 
     """
 
-    def __init__(self):
-        self.primes = [2, 3]
+    def __init__(self, grow_limit=1 << 24, mr_rounds=20, path=None, max_table=None):
+        """
+        @param grow_limit: isprime() may extend the sieve for numbers up to this bound. Bigger numbers that lie beyond the 
+            sieved range are tested with Miller-Rabin instead, so the table (and isprime's memory and latency) never grows 
+            on their account. 0 means isprime() never grows the table, None means it always does. 
+        @param mr_rounds: number of random witnesses used for numbers too big for the deterministic witness sets.
+        @param path: file that holds the prime table. It is created if it doesn't exist, otherwise the primes already in 
+            it are used as-is. Extending the table appends to the file in place, under an exclusive lock, so processes 
+            sharing the file never sieve the same range twice. 
+        @param max_table: bounded-cache mode. The table only grows up to this bound (or to the square root of a query, 
+            whichever is larger, since those base primes are needed for sieving). Primes past it are sieved one segment at
+            a time and thrown away once used, except for the one most recent segment that isprime() looked at. None means 
+            the table grows as far as it is asked to. 
+        """
+        self.grow_limit = grow_limit
+        self.mr_rounds = mr_rounds
+        self.max_table = max_table
+        self._window = (0, -1, array('Q'))
+        self._spf = None
+        self._spf_bound = 0
+        self._bitmap = (0, None)
+        self.primes = array('Q', [2, 3])
         self._multiples = {}
         self._greatest_checked_val = 3
+        self._table = None
+        self._mmap = None
+        if path is not None:
+            if not os.path.exists(path):
+                # Write the new table under a temporary name and link it into place, so that processes racing to create 
+                # the same file never see it half-written or truncate one that another process already extended.
+                tmp = f'{path}.{os.getpid()}.tmp'
+                self.save(tmp)
+                try:
+                    os.link(tmp, path)
+                except FileExistsError:
+                    pass
+                finally:
+                    os.remove(tmp)
+            self._table = open(path, 'r+b')
+            self._reload_table()
         
     def clear_primes(self):
-        self.primes = [2, 3]
+        """Reset to the primes [2, 3]. If the table is file-backed, the file is left untouched and the instance just stops using it."""
+        if self._table is not None:
+            self._table.close()
+        self._table = None
+        self._mmap = None
+        self.primes = array('Q', [2, 3])
         self._multiples = {}
         self._greatest_checked_val = 3
+        self._window = (0, -1, array('Q'))
+        self._spf = None
+        self._spf_bound = 0
+        self._bitmap = (0, None)
+
+    def save(self, path):
+        """write the prime table to a file that can later be opened with JPrime(path=path)."""
+        with open(path, 'wb') as f:
+            f.write(_TABLE_HEADER.pack(_TABLE_MAGIC, _TABLE_VERSION, _TABLE_FLAGS, self._greatest_checked_val, len(self.primes)))
+            f.write(array('Q', self.primes).tobytes())
 
     def isprime(self, num):
         # trivial non-prime check
         if num != 2 and (num % 2 == 0 or num < 2):
             return False
-        self._extend_primes(num)
-        return num in self.primes
+        if num > self._greatest_checked_val:
+            if self.grow_limit is not None and num > self.grow_limit:
+                return is_probable_prime(num, self.mr_rounds)
+            if self.max_table is not None and num > self.max_table:
+                return self._window_isprime(num)
+            self._extend_primes(num)
+        i = bisect_left(self.primes, num)
+        return i < len(self.primes) and self.primes[i] == num
 
-    def get_prime_range(self, upperbound, lowerbound = 2):
-        """return a list of all primes from lowerbound to upperbound, inclusive."""
-        self._extend_primes(upperbound)
-        return list(itertools.filterfalse(lambda x: x < lowerbound or x > upperbound, self.primes))
+    def isprime_array(self, nums):
+        """Vectorized isprime(). 
         
+        Take a NumPy integer array (or anything else supporting the buffer protocol, such as array.array) and return a
+        boolean NumPy array of the same shape that is True where the number is prime. Numbers that the grow_limit and 
+        max_table policies allow the table to cover are looked up in a bitmap built from the table. The rest are run 
+        through a vectorized Miller-Rabin when they fit in 32 bits, and through is_probable_prime() one at a time 
+        otherwise.
 
-    def _extend_primes(self, upperbound):
-        """extend the class object's list of primes by doing a sieve on the values that haven't been checked previously."""
+        Without NumPy, nums may be any iterable of ints and a list of bools is returned. 
+        """
+        if np is None:
+            return [self.isprime(int(num)) for num in nums]
+        nums = np.asarray(nums)
+        if nums.dtype.kind not in 'iu':
+            raise TypeError(f'isprime_array() needs integers, not {nums.dtype}')
+        mask = np.zeros(nums.shape, dtype=bool)
+        positive = nums > 1
+        values = nums[positive].astype(np.uint64)
+        
+        # grow the table once, as far as the policies allow, instead of once per number 
+        growable = values
+        for limit in (self.grow_limit, self.max_table):
+            if limit is not None:
+                growable = growable[growable <= limit]
+        if growable.size:
+            self._extend_primes(int(growable.max()))
+
+        result = np.zeros(values.shape, dtype=bool)
+        in_table = values <= self._greatest_checked_val
+        result[in_table] = self._bitmap_lookup(values[in_table])
+        outside = ~in_table
+        vectorizable = outside & (values < 1 << 32)
+        result[vectorizable] = _is_prime_u32(values[vectorizable])
+        big = outside & ~vectorizable
+        result[big] = [is_probable_prime(int(num), self.mr_rounds) for num in values[big]]
+        mask[positive] = result
+        return mask
+
+    def _bitmap_lookup(self, values):
+        """gather the primality of values (uint64 array, all within the table) from a bitmap with one bit per odd number."""
+        limit, bitmap = self._bitmap
+        if limit != self._greatest_checked_val:
+            limit = self._greatest_checked_val
+            flags = np.zeros(limit // 2 + 1, dtype=bool)
+            flags[np.frombuffer(self.primes, dtype=np.uint64)[1:] >> 1] = True
+            bitmap = np.packbits(flags, bitorder='little')
+            self._bitmap = (limit, bitmap)
+        i = values >> 1
+        odd_hits = ((bitmap[i >> 3] >> (i & 7).astype(np.uint8)) & 1).astype(bool)
+        return (odd_hits & (values & 1 == 1)) | (values == 2)
+
+    def iter_primes(self, start=2, stop=None):
+        """Generator that yields the primes from start to stop, inclusive, in ascending order. If stop is None it never ends.
+
+        Primes already in the table are read from it. Past the table, one segment is sieved at a time and its primes are
+        yielded as they come. Only the base primes (up to the square root of the current segment's end) are added to the 
+        table, so memory use stays flat no matter how far the iteration goes. 
+        """
+        # index based so that the table can be extended while the generator is suspended
+        i = bisect_left(self.primes, start)
+        while i < len(self.primes):
+            p = self.primes[i]
+            if stop is not None and p > stop:
+                return
+            yield p
+            i += 1
+        lo = max(start, self._greatest_checked_val + 2)
+        while stop is None or lo <= stop:
+            hi = lo + 2 * _SEGMENT_SIZE - 1
+            if stop is not None:
+                hi = min(hi, stop)
+            self._extend_primes(math.isqrt(hi))
+            yield from sieve_window(lo, hi, self.primes)
+            lo = hi + 1
+
+    def get_prime_range(self, upperbound, lowerbound = 2, workers=None):
+        """return a list of all primes from lowerbound to upperbound, inclusive.
+        
+        @param workers: if greater than 1, sieve the range in a pool of that many processes. When the range starts inside
+            (or right after) the sieved table, the table is extended in parallel and keeps the results. A window that starts 
+            further out, such as [10^10, 10^10 + 10^9], can't join the table without leaving a gap, so only its base primes
+            (those up to sqrt(upperbound)) are stored and the window's primes are just returned.
+
+        In bounded-cache mode (see max_table) the part of the range past max_table is sieved without being stored. 
+        """
+        parallel = workers is not None and workers > 1
+        if parallel and lowerbound > self._greatest_checked_val + 2:
+            self._extend_primes(math.isqrt(upperbound))
+            return self._sieve_parallel(lowerbound, upperbound, workers).tolist()
+        limit = upperbound if self.max_table is None else min(upperbound, self.max_table)
+        if parallel:
+            self._extend_primes_parallel(limit, workers)
+        self._extend_primes(limit)
+        start = bisect_left(self.primes, lowerbound)
+        stop = bisect_right(self.primes, upperbound)
+        primes = self.primes[start:stop].tolist()
         if self._greatest_checked_val < upperbound - 1:
-            extension = list(range(self._greatest_checked_val + 2, upperbound + 1, 2))
-            extension = self._sieve(extension)
+            lo = max(lowerbound, self._greatest_checked_val + 2)
+            if parallel:
+                self._extend_primes(math.isqrt(upperbound))
+                primes.extend(self._sieve_parallel(lo, upperbound, workers))
+            else:
+                primes.extend(self.iter_primes(lo, upperbound))
+        return primes
+        
+
+    def prime_pi(self, x):
+        """return the number of primes less than or equal to x."""
+        if x < 2:
+            return 0
+        self._extend_primes(x if self.max_table is None else min(x, self.max_table))
+        count = bisect_right(self.primes, x)
+        if self._greatest_checked_val < x - 1:
+            count += sum(1 for _ in self.iter_primes(self._greatest_checked_val + 2, x))
+        return count
+
+    def nth_prime(self, k):
+        """return the kth prime, counting from nth_prime(1) == 2."""
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        if k > len(self.primes):
+            # Rosser's bound: the kth prime is below k(ln k + ln ln k) for k >= 6
+            bound = 13 if k < 6 else int(k * (math.log(k) + math.log(math.log(k)))) + 1
+            self._extend_primes(bound if self.max_table is None else min(bound, self.max_table))
+        if k > len(self.primes):
+            return next(itertools.islice(self.iter_primes(self._greatest_checked_val + 2), k - len(self.primes) - 1, None))
+        return self.primes[k - 1]
+
+    def build_spf(self, bound):
+        """build a smallest-prime-factor table for the odd numbers up to bound, which factorize() then uses for numbers in 
+        that range.
+
+        The table is a typed array with one entry per odd number (index i represents 2i + 1) holding its smallest prime 
+        factor, or 0 for primes. The smallest prime factor of a composite is never above sqrt(bound), so the entries
+        only take 2 bytes each for bounds below 2^32. 
+        """
+        if bound <= self._spf_bound:
+            return
+        root = math.isqrt(bound)
+        spf = array('H' if root < 1 << 16 else 'I')
+        spf.frombytes(bytes(spf.itemsize * (bound // 2 + 1)))
+        # Cross off from the biggest base down, so that each entry ends up holding the smallest base that divides it.  
+        for base in reversed(self.get_prime_range(root, 3)):
+            start = base * base // 2
+            spf[start::base] = array(spf.typecode, [base]) * ((len(spf) - 1 - start) // base + 1)
+        self._spf = spf
+        self._spf_bound = bound
+
+    def factorize(self, num):
+        """return the prime factors of num as an ascending list, with repeats. e.g. 360 -> [2, 2, 2, 3, 3, 5]
+
+        Numbers covered by the smallest-prime-factor table (see build_spf()) are factored by table lookups. Larger ones 
+        are trial divided by the small primes, and any composite cofactor left after that is split with Pollard's rho.
+        """
+        if num < 1:
+            raise ValueError('only positive integers can be factorized')
+        # factors of 2 
+        twos = (num & -num).bit_length() - 1
+        factors = [2] * twos
+        num >>= twos
+        if num > self._spf_bound:
+            self._extend_primes(_TRIAL_DIVISION_BOUND)
+            for p in itertools.islice(self.primes, 1, None):
+                if p > _TRIAL_DIVISION_BOUND or p * p > num or num <= self._spf_bound:
+                    break
+                while num % p == 0:
+                    factors.append(p)
+                    num //= p
+        if num <= self._spf_bound:
+            spf = self._spf
+            while num > 1:
+                p = spf[num >> 1]
+                if p == 0:
+                    factors.append(num)
+                    break
+                factors.append(p)
+                num //= p
+        elif num > 1:
+            factors.extend(self._split(num))
+            factors.sort()
+        return factors
+
+    def factorize_many(self, nums, spf_bound=1 << 24):
+        """return a list holding the factorize() result for each number in the iterable nums. 
+        
+        A smallest-prime-factor table is built up front covering the largest of nums, up to spf_bound, so that most of 
+        the numbers are factored by lookups alone. Those lookups are done for all the numbers at once with NumPy when
+        it's available, otherwise in a loop that does nothing but read the table. Numbers outside the table go through
+        factorize(). 
+        """
+        nums = list(nums)
+        if not nums:
+            return []
+        self.build_spf(min(max(nums), spf_bound))
+        bound = self._spf_bound
+        # The result is one small list per number. Allocating that many containers would otherwise set off a cyclic
+        # garbage collection every few hundred of them, each walking everything allocated so far.
+        with _gc_paused():
+            if np is not None:
+                try:
+                    values = np.array(nums, dtype=np.int64)
+                except OverflowError:
+                    values = None
+                if values is not None:
+                    in_table = (values >= 1) & (values <= bound)
+                    if in_table.all():
+                        return self._factorize_table(values)
+                    result = [None] * len(nums)
+                    for i, factors in zip(np.flatnonzero(in_table).tolist(), self._factorize_table(values[in_table])):
+                        result[i] = factors
+                    for i in np.flatnonzero(~in_table).tolist():
+                        result[i] = self.factorize(nums[i])
+                    return result
+
+            spf = self._spf
+            factorize = self.factorize
+            result = []
+            append = result.append
+            for num in nums:
+                if not 0 < num <= bound:
+                    append(factorize(num))
+                    continue
+                twos = (num & -num).bit_length() - 1
+                factors = [2] * twos
+                num >>= twos
+                while num > 1:
+                    p = spf[num >> 1]
+                    if p == 0:
+                        factors.append(num)
+                        break
+                    factors.append(p)
+                    num //= p
+                append(factors)
+            return result
+
+    def _factorize_table(self, values):
+        """factorize() every number in the int64 array values, which must all be covered by the smallest-prime-factor 
+        table, by stepping all of them through the table together. 
+        
+        Each step emits the current smallest prime factor of every number not yet fully factored, as (index, position 
+        within that number's factors, factor). The factors come out ascending, so once the count for each number is 
+        known they're scattered into one flat array and sliced back into lists.
+        """
+        values = values.copy()
+        spf = np.frombuffer(self._spf, dtype=np.uint16 if self._spf.itemsize == 2 else np.uint32)
+        count = np.zeros(len(values), dtype=np.int64)
+        indices, positions, factors = [], [], []
+        def emit(idx, f):
+            indices.append(idx)
+            positions.append(count[idx])
+            factors.append(f)
+            count[idx] += 1
+
+        idx = np.flatnonzero(values & 1 == 0)
+        while len(idx):
+            emit(idx, np.full(len(idx), 2, dtype=np.int64))
+            values[idx] >>= 1
+            idx = idx[values[idx] & 1 == 0]
+        idx = np.flatnonzero(values > 1)
+        while len(idx):
+            num = values[idx]
+            p = spf[num >> 1].astype(np.int64)
+            p = np.where(p == 0, num, p) # a 0 entry means num itself is prime
+            emit(idx, p)
+            num //= p
+            values[idx] = num
+            idx = idx[num > 1]
+
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(count, out=offsets[1:])
+        flat = np.empty(int(offsets[-1]), dtype=np.int64)
+        if indices:
+            flat[offsets[np.concatenate(indices)] + np.concatenate(positions)] = np.concatenate(factors)
+        flat = flat.tolist()
+        offsets = offsets.tolist()
+        return list(map(flat.__getitem__, map(slice, offsets, offsets[1:])))
+
+    def _split(self, num):
+        """return the prime factors, in no particular order, of an odd num that has no factors below the trial division bound."""
+        if is_probable_prime(num, self.mr_rounds):
+            return [num]
+        d = _pollard_brent(num)
+        return self._split(d) + self._split(num // d)
+
+    def _window_isprime(self, num):
+        """primality test for a number past the (bounded) table, answered from the cached window of primes around num. 
+        
+        The window is the aligned block of 2*_SEGMENT_SIZE values holding num. It is only re-sieved when num falls
+        outside the block cached by the previous call.
+        """
+        lo, hi, window = self._window
+        if not lo <= num <= hi:
+            span = 2 * _SEGMENT_SIZE
+            lo = num - num % span
+            hi = lo + span - 1
+            self._extend_primes(math.isqrt(hi))
+            window = sieve_window(lo, hi, self.primes)
+            self._window = (lo, hi, window)
+        i = bisect_left(window, num)
+        return i < len(window) and window[i] == num
+
+    def _extend_primes(self, upperbound):
+        """extend the class object's list of primes by doing a sieve on the values that haven't been checked previously.
+        
+        The unchecked values are sieved one fixed-size segment at a time so that the sieve's working memory is bounded 
+        by _SEGMENT_SIZE no matter how large upperbound is.
+        """
+        if self._greatest_checked_val >= upperbound - 1:
+            return
+        # The new primes are only stored once the whole extension is done, so the base primes (up to sqrt(upperbound))
+        # have to be in the table beforehand.
+        self._extend_primes(math.isqrt(upperbound))
+        with self._table_lock():
+            extension = array('Q')
+            while self._greatest_checked_val < upperbound - 1:
+                lo = self._greatest_checked_val + 2
+                count = min(_SEGMENT_SIZE, (upperbound - lo) // 2 + 1)
+                hi = lo + 2 * (count - 1)
+                extension.extend(self._sieve(lo, hi))
+                self._greatest_checked_val = hi
+            self._store(extension)
+
+    def _extend_primes_parallel(self, upperbound, workers):
+        """extend the list of primes up to upperbound like _extend_primes(), but sieve the unchecked values in a process pool."""
+        self._extend_primes(math.isqrt(upperbound))
+        with self._table_lock():
+            lo = self._greatest_checked_val + 2
+            if lo > upperbound:
+                return
+            extension = self._sieve_parallel(lo, upperbound, workers)
+            self._greatest_checked_val = upperbound if upperbound % 2 else upperbound - 1
+            self._store(extension)
+            # the pool didn't update _multiples.
+            self._sync_multiples()
+
+    def _sync_multiples(self):
+        """Rebuild _multiples for a table that was extended without _sieve() (by a process pool or another process) so that
+        later sequential extensions pick up at _greatest_checked_val."""
+        self._multiples = {}
+        for base in itertools.islice(self.primes, 1, None):
+            if base * base > self._greatest_checked_val:
+                break
+            multiple = self._greatest_checked_val // base * base
+            self._multiples[base] = multiple if multiple % 2 else multiple - base
+
+    def _store(self, extension):
+        """append the primes in extension, which run up to _greatest_checked_val, to the table."""
+        if self._table is None:
             self.primes.extend(extension)
-            self.primes = list(set(self.primes)) # remove duplicates. Have not yet figured out a way to stop them from being produced in the first place.
+            return
+        count = len(self.primes) + len(extension)
+        self._table.seek(_TABLE_HEADER.size + 8 * len(self.primes))
+        self._table.write(extension.tobytes())
+        self._table.flush()
+        # the header is only updated after the primes themselves are in the file
+        self._table.seek(0)
+        self._table.write(_TABLE_HEADER.pack(_TABLE_MAGIC, _TABLE_VERSION, _TABLE_FLAGS, self._greatest_checked_val, count))
+        self._table.flush()
+        self._map_table(count)
+
+    @contextmanager
+    def _table_lock(self):
+        """hold an exclusive lock on the table file (if any) and pick up whatever other processes have added to it."""
+        if self._table is None:
+            yield
+            return
+        if fcntl is not None:
+            fcntl.flock(self._table, fcntl.LOCK_EX)
+        try:
+            self._reload_table()
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._table, fcntl.LOCK_UN)
 
-    def _sieve(self, num_range):
-        """Erotasthenes' Sieve
+    def _reload_table(self):
+        """read the table file's header and remap the file if the table in it has grown."""
+        self._table.seek(0)
+        header = self._table.read(_TABLE_HEADER.size)
+        if len(header) < _TABLE_HEADER.size:
+            raise ValueError(f'{self._table.name} is not a JPrime table')
+        magic, version, flags, greatest_checked_val, count = _TABLE_HEADER.unpack(header)
+        if magic != _TABLE_MAGIC or version != _TABLE_VERSION:
+            raise ValueError(f'{self._table.name} is not a version {_TABLE_VERSION} JPrime table')
+        if flags != _TABLE_FLAGS:
+            raise ValueError(f'{self._table.name} was written on a machine with a different byte order')
+        if self._mmap is None or greatest_checked_val > self._greatest_checked_val:
+            self._map_table(count)
+            self._greatest_checked_val = greatest_checked_val
+            self._sync_multiples()
 
-        A "base" is selected. The multiples of that base are calculated and removed from num_range.
-        The base is incremented and the process repeats. The remaining values in num_range are primes.
+    def _map_table(self, count):
+        # Views previously handed out keep the old map alive until they are released, so it is not closed here. 
+        self._mmap = mmap.mmap(self._table.fileno(), 0, access=mmap.ACCESS_READ)
+        self.primes = memoryview(self._mmap)[_TABLE_HEADER.size:_TABLE_HEADER.size + 8 * count].cast('Q')
+
+    def _sieve_parallel(self, lo, hi, workers):
+        """return an array of the primes from lo to hi, inclusive, sieved in a pool of "workers" processes. 
+        
+        The range is split into contiguous chunks (several per worker, to even out the load), which are sieved 
+        independently against the base primes up to sqrt(hi) and joined back together in order. The table must already
+        hold those base primes.
+        """
+        base_primes = array('Q', self.primes[:bisect_right(self.primes, math.isqrt(hi))])
+        chunks = workers * 4
+        span = max((hi - lo) // chunks + 1, 2 * _SEGMENT_SIZE)
+        bounds = [(x, min(x + span - 1, hi)) for x in range(lo, hi + 1, span)]
+        result = array('Q')
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(base_primes,)) as pool:
+            for chunk in pool.map(_sieve_chunk, bounds):
+                result.extend(chunk)
+        return result
+
+    def _sieve(self, lo, hi):
+        """Segmented Erotasthenes' Sieve
+
+        Return the primes among the odd integers lo, lo+2, ... hi. The segment is held in a bytearray with one byte per
+        odd value (index i represents lo + 2i). For each base prime, the multiples falling inside the segment are crossed 
+        off with a single slice assignment instead of one removal at a time.
         
-        @param num_range: ordered list of all odd integers in some arbitary range. 
+        @param lo: odd integer, must be _greatest_checked_val + 2 so that every segment picks up where the last left off. 
+        @param hi: odd integer >= lo
         
         Notes:
-            Erotasthenes' sieve for the range 0-x only requires checking multiples of numbers less than sqrt(x), so
-            base is only incremented up to sqrt(x).
+            Erotasthenes' sieve for the range 0-x only requires checking multiples of primes less than sqrt(x), so
+            only bases up to sqrt(hi) are used.
 
             An updateable sieve with no need to store a full list of checked multiples was desired. For this, the
-            dictionary _multiples is used. The keys of _multiples represent bases. The values represent the largest multiple
-            of that base that has been calculated and crossed-off to date. Only as many as sqrt(biggest_range_ever_checked) KV pairs 
-            have to be stored in _multiples.
+            dictionary _multiples is used. The keys of _multiples represent (prime) bases. The values represent the largest 
+            odd multiple of that base that has been crossed-off to date. Only as many as pi(sqrt(biggest_range_ever_checked)) 
+            KV pairs have to be stored in _multiples.
+
+            For any K, this sieve picks up where the last sieve left off by crossing off V + 2K, V + 4K ... until the 
+            multiple exceeds hi. A new base K starts at K*K, since every smaller multiple of K has a smaller prime factor 
+            and was already crossed off by that factor. 
 
-            For any K, the multiplier which produced its current V is obtained like: m = K/V. From there, this sieve can pick up where
-            the last sieve left off by incrementing m and crossing off (m*K) until that product exceeds the biggest number in num_range.
+            Any multiple of an even will be even (not prime), and even multiples of odd bases are even too. Thus only the odd 
+            multiples are crossed-off, which is a step of 2K in value and K in the segment's index. 
 
-            Any multiple of an even will be even (not prime). Thus: base += 2 to avoid checking them.
+            Bases between lo and sqrt(hi) can only come from the segment itself. They are discovered in increasing order, 
+            after every smaller base has crossed off its multiples, so a value that is still marked at that point is prime. 
         """
-        range_max = num_range[-1]
-        root = math.ceil(math.sqrt(range_max))
-        for base in range(3, root+1, 2):
-            if base not in self._multiples.keys():
-                # multiplying by (base-2) ensures that the first m for a new base is base. So that you don't get redunant checks like base=5, m=3. That was already checked when base=m, m=5
-                self._multiples[base] = base*(base-2) 
-
-            m = int((self._multiples[base] / base)) + 2
-            while True:
-                multiple = base * m
-                if multiple > range_max:
-                    break
-                if multiple > self._greatest_checked_val:
-                    self._greatest_checked_val = multiple 
-                try:
-                    num_range.remove(multiple)
-                except ValueError:
-                    pass
-                m += 2
-            self._multiples[base] = base * (m - 2)
-        return num_range
+        count = (hi - lo) // 2 + 1
+        segment = bytearray(b'\x01') * count
+        
+        def cross_off(base):
+            if base not in self._multiples:
+                # multiplying by (base-2) ensures that the first multiple crossed-off for a new base is base*base. 
+                self._multiples[base] = base * (base - 2)
+            start = (self._multiples[base] + 2 * base - lo) // 2
+            if start < count:
+                n = (count - 1 - start) // base + 1
+                segment[start::base] = bytes(n)
+                self._multiples[base] += 2 * base * n
 
+        # bases that were found by earlier segments
+        for base in itertools.islice(self.primes, 1, None):
+            if base * base > hi:
+                break
+            cross_off(base)
+        # bases that lie inside this segment
+        i = 0
+        while True:
+            base = lo + 2 * i
+            if base * base > hi:
+                break
+            if segment[i]:
+                cross_off(base)
+            i += 1
+        return array('Q', itertools.compress(range(lo, hi + 1, 2), segment))
 
 
-if __name__ == '__main__':
-    from time import time
+def sieve_window(lo, hi, base_primes):
+    """Segmented Erotasthenes' Sieve over an arbitrary window. 
+    
+    Return an array of all primes from lo to hi, inclusive. Unlike JPrime._sieve() nothing is carried over between calls, 
+    the first multiple of each base inside the window is computed directly, so windows can be sieved in any order or in
+    parallel.
+
+    @param base_primes: ascending sequence holding at least every prime up to sqrt(hi)
+    """
+    result = array('Q')
+    if lo <= 2 <= hi:
+        result.append(2)
+    lo = max(lo, 3) | 1
+    while lo <= hi:
+        count = min(_SEGMENT_SIZE, (hi - lo) // 2 + 1)
+        seg_hi = lo + 2 * (count - 1)
+        segment = bytearray(b'\x01') * count
+        for base in base_primes:
+            if base == 2:
+                continue
+            if base * base > seg_hi:
+                break
+            # first odd multiple of base that is >= lo, but never below base*base so that base itself isn't crossed off
+            multiple = max(-(-lo // base) * base, base * base)
+            if multiple % 2 == 0:
+                multiple += base
+            start = (multiple - lo) // 2
+            if start < count:
+                segment[start::base] = bytes((count - 1 - start) // base + 1)
+        result.extend(itertools.compress(range(lo, seg_hi + 1, 2), segment))
+        lo = seg_hi + 2
+    return result
+
+
+def _init_worker(base_primes):
+    """process pool initializer: send the base primes to each worker once instead of with every chunk."""
+    global _worker_base_primes
+    _worker_base_primes = base_primes
+
+def _sieve_chunk(bounds):
+    return sieve_window(bounds[0], bounds[1], _worker_base_primes)
+
 
-    upperbounds = [100, 1000, 10000, 30000, 50000, 100000, 500000]
+@contextmanager
+def _gc_paused():
+    """disable the cyclic garbage collector for the duration of the block, if it's enabled"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def is_probable_prime(num, rounds=20):
+    """Miller-Rabin primality test. 
+    
+    The result is exact for num < 3317044064679887385961981 (which covers every 64-bit int), using the smallest known 
+    deterministic witness set for num's size. Above that, "rounds" random witnesses are used and a composite is 
+    wrongly reported as prime with probability at most 4^-rounds.
+    """
+    if num < 2:
+        return False
+    for p in _SMALL_PRIMES:
+        if num % p == 0:
+            return num == p
     
+    # num-1 = d * 2^s with d odd
+    d, s = num - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+
+    for bound, witnesses in _MR_WITNESSES:
+        if num < bound:
+            break
+    else:
+        witnesses = [random.randrange(2, num - 1) for _ in range(rounds)]
+
+    for a in witnesses:
+        x = pow(a, d, num)
+        if x == 1 or x == num - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % num
+            if x == num - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _pollard_brent(num):
+    """return a non-trivial factor of the odd composite num using Brent's variant of Pollard's rho."""
+    while True:
+        y, c, m = random.randrange(1, num), random.randrange(1, num), 128
+        g, r, q = 1, 1, 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % num
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(m, r - k)):
+                    y = (y * y + c) % num
+                    q = q * abs(x - y) % num
+                g = math.gcd(q, num)
+                k += m
+            r *= 2
+        if g == num:
+            # the batched gcd overshot, step back one value at a time
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % num
+                g = math.gcd(abs(x - ys), num)
+        if g != num:
+            return g
+
+
+def _is_prime_u32(nums):
+    """Vectorized deterministic Miller-Rabin for a NumPy uint64 array of numbers >= 2 and below 2^32. 
     
-    for upperbound in upperbounds:
-        print('=====================')
-        print(f'Time comparison for getting primes in range 2-{upperbound}')
-        p1 = JPrime()
-        p2 = JPrime()
-
-
-        # direct approach
-        start = time()
-        p2.get_prime_range(upperbound)
-        direct_time = time() - start
-        print('directly:\n\t', direct_time)
-
-        #incremental approach
-        increments = int(math.ceil(.0005 * upperbound))
-        start = time()
-        for x in range(1, increments+1):
-            p1.get_prime_range(upperbound//increments*x)
-        incremental_time = time() - start
-        print(f'in increments({increments}):\n\t{incremental_time}')
-
-
-        print('ratio direct/incremental:', direct_time/incremental_time)
-        print('=====================\n\n')
\ No newline at end of file
+    Witnesses 2, 7 and 61 are exact below 4759123141. Keeping the numbers below 2^32 means every product of two residues 
+    fits in a uint64, so the modular arithmetic can't overflow. A witness that is a multiple of n (61 for n = 61) 
+    proves nothing and is skipped for that n.
+    """
+    result = np.ones(nums.shape, dtype=bool)
+    undecided = np.ones(nums.shape, dtype=bool)
+    for p in _SMALL_PRIMES:
+        divisible = nums % p == 0
+        result[divisible] = nums[divisible] == p
+        undecided &= ~divisible
+    n = nums[undecided]
+    
+    # n-1 = d * 2^s with d odd
+    d = n - 1
+    s = np.zeros(n.shape, dtype=np.uint64)
+    while True:
+        even = d & 1 == 0
+        if not even.any():
+            break
+        d[even] >>= 1
+        s[even] += 1
+
+    passed = np.ones(n.shape, dtype=bool)
+    for a in (2, 7, 61):
+        # x = a^d mod n by square-and-multiply
+        x = np.ones(n.shape, dtype=np.uint64)
+        base = np.full(n.shape, a, dtype=np.uint64) % n
+        skip = base == 0
+        e = d.copy()
+        while e.any():
+            odd = e & 1 == 1
+            x[odd] = x[odd] * base[odd] % n[odd]
+            base = base * base % n
+            e >>= 1
+        ok = (x == 1) | (x == n - 1)
+        for r in range(1, int(s.max(initial=0))):
+            x = x * x % n
+            ok |= (x == n - 1) & (r < s)
+        passed &= ok | skip
+    result[undecided] = passed
+    return result
+
+
+_SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+# (bound, witnesses): testing against these witnesses is exact for every num < bound
+_MR_WITNESSES = (
+    (2047, (2,)),
+    (1373653, (2, 3)),
+    (25326001, (2, 3, 5)),
+    (3215031751, (2, 3, 5, 7)),
+    (2152302898747, (2, 3, 5, 7, 11)),
+    (3474749660383, (2, 3, 5, 7, 11, 13)),
+    (341550071728321, (2, 3, 5, 7, 11, 13, 17)),
+    (3825123056546413051, (2, 3, 5, 7, 11, 13, 17, 19, 23)),
+    (318665857834031151167461, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)),
+    (3317044064679887385961981, _SMALL_PRIMES),
+)
+
+# Table file layout: a header (magic, format version, flags, _greatest_checked_val, number of primes) followed by the
+# sorted primes as unsigned 64-bit ints in the byte order of the machine that wrote them (flags bit 0 = big-endian).
+_TABLE_HEADER = struct.Struct('<8sIIQQ')
+_TABLE_MAGIC = b'JPRIMES\x00'
+_TABLE_VERSION = 1
+_TABLE_FLAGS = int(sys.byteorder == 'big')
+
+# factorize() trial divides numbers past the smallest-prime-factor table by the primes up to this bound before 
+# falling back to Pollard's rho
+_TRIAL_DIVISION_BOUND = 1 << 16
+
+# number of odd values sieved per segment; one byte each, so a segment fits comfortably in a typical L2 cache. 
+_SEGMENT_SIZE = 1 << 18
+
+
+if __name__ == '__main__':
+    # timing runs live in the benchmark suite, see jprime_bench.py for its options
+    from jtools.jmath.jprime_bench import main
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Benchmark suite for jtools.jmath.jprime.
+
+Measures sieve throughput, isprime() latency against warm and cold tables, incremental versus one-shot extension,
+peak memory and scaling with the number of worker processes. Results are written as JSON and can be compared
+against a stored baseline, in which case any metric that got slower (or bigger) than the baseline by more than the
+tolerance is reported and the script exits with status 1.
+
+Every metric is either seconds or bytes, so lower is always better. Timings are the best of several repeats to keep
+noise out of the comparison.
+
+usage:
+    python -m jtools.jmath.jprime_bench --output results.json
+    python -m jtools.jmath.jprime_bench --baseline baseline.json            # compare, exit 1 on regression
+    python -m jtools.jmath.jprime_bench --save-baseline baseline.json       # record a new baseline
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+from jtools.jmath.jprime import JPrime
+from jtools.jconsole import red, green, yellow
+
+
+def best_of(repeats, fn):
+    """return the shortest wall time, in seconds, of "repeats" calls to fn."""
+    best = math.inf
+    for _ in range(repeats):
+        start = perf_counter()
+        fn()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def bench_sieve(upperbounds, repeats):
+    """one-shot get_prime_range() from a fresh table."""
+    return {f'sieve/oneshot/{n}': best_of(repeats, lambda: JPrime().get_prime_range(n)) for n in upperbounds}
+
+
+def bench_incremental(upperbounds, repeats):
+    """the table grown to the same bounds in many small steps, as the old __main__ timing loop did."""
+    results = {}
+    for n in upperbounds:
+        increments = int(math.ceil(.0005 * n))
+        def incremental():
+            p = JPrime()
+            for x in range(1, increments + 1):
+                p.get_prime_range(n // increments * x)
+        results[f'sieve/incremental/{n}'] = best_of(repeats, incremental)
+    return results
+
+
+def bench_isprime(table_size, queries, repeats):
+    """mean seconds per isprime() call.
+
+    - warm: the table already covers every query.
+    - cold: a fresh table for each batch of queries, so early queries pay for growing it (up to grow_limit).
+    - beyond: queries far past the table, answered by Miller-Rabin.
+    """
+    rng = random.Random(0)
+    nums = [rng.randrange(table_size) for _ in range(queries)]
+    big = [rng.randrange(10**15, 10**16) for _ in range(queries)]
+    warm = JPrime()
+    warm.get_prime_range(table_size)
+    def cold():
+        p = JPrime()
+        for num in nums:
+            p.isprime(num)
+    return {
+        f'isprime/warm/{table_size}': best_of(repeats, lambda: [warm.isprime(num) for num in nums]) / queries,
+        f'isprime/cold/{table_size}': best_of(repeats, cold) / queries,
+        'isprime/beyond/1e16': best_of(repeats, lambda: [warm.isprime(num) for num in big]) / queries,
+    }
+
+
+def bench_memory(upperbounds):
+    """peak bytes allocated (per tracemalloc) while sieving from a fresh table."""
+    results = {}
+    for n in upperbounds:
+        tracemalloc.start()
+        JPrime().get_prime_range(n)
+        results[f'memory/peak/{n}'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results
+
+
+def bench_workers(upperbound, worker_counts, repeats):
+    """get_prime_range() from a fresh table with different numbers of worker processes (1 means the serial sieve)."""
+    return {f'workers/{w}/{upperbound}': best_of(repeats, lambda: JPrime().get_prime_range(upperbound, workers=w))
+            for w in worker_counts}
+
+
+def run(quick=False):
+    """run every benchmark and return the results as a dict ready to be dumped to JSON."""
+    if quick:
+        upperbounds, repeats, table_size, queries = [10**4, 10**5, 10**6], 3, 10**5, 10**4
+    else:
+        upperbounds, repeats, table_size, queries = [10**4, 10**5, 10**6, 10**7], 5, 10**7, 10**5
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, cpus} | {2**i for i in range(2, cpus.bit_length()) if 2**i < cpus})
+
+    metrics = {}
+    metrics.update(bench_sieve(upperbounds, repeats))
+    metrics.update(bench_incremental(upperbounds, repeats))
+    metrics.update(bench_isprime(table_size, queries, repeats))
+    metrics.update(bench_memory(upperbounds))
+    metrics.update(bench_workers(upperbounds[-1], worker_counts, 1 if quick else 3))
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': cpus,
+            'quick': quick,
+        },
+        'metrics': metrics,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """return a list of (metric, baseline value, current value) for every metric that regressed by more than tolerance
+    (a fraction, e.g. 0.2 for 20%). Metrics missing from either side are skipped."""
+    regressions = []
+    for name, old in baseline['metrics'].items():
+        new = results['metrics'].get(name)
+        if new is not None and old > 0 and new > old * (1 + tolerance):
+            regressions.append((name, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark jtools.jmath.jprime')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes and fewer repeats')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results against this JSON file and exit 1 on any regression')
+    parser.add_argument('--save-baseline', help='write the results to this JSON file to serve as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown as a fraction (default 0.2)')
+    args = parser.parse_args(argv)
+
+    results = run(quick=args.quick)
+    for name, value in results['metrics'].items():
+        unit = 'B' if name.startswith('memory/') else 's'
+        print(f'{name:<32} {value:.6g} {unit}')
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('quick') != results['meta']['quick']:
+            print(yellow('warning: baseline and results were not run with the same --quick setting'))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            for name, old, new in regressions:
+                print(red(f'REGRESSION {name}: {old:.6g} -> {new:.6g} ({new / old - 1:+.0%})'))
+            return 1
+        print(green(f'no regressions beyond {args.tolerance:.0%}'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
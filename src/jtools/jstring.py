@@ -1,6 +1,14 @@
 """some string utilities """
+import re
 import string
 
+_TITLECASE_SPECIALS = '"([{/\\'
+_AFTER_SPECIAL = re.compile(r'(?<=["(\[{/\\]).', re.DOTALL)
+_ABBREVIATION = re.compile(r'[A-Za-z]\.(?:[A-Za-z]\.)*')
+_ROMAN_NUMERAL = re.compile(r'[ivxIVX]+')
+_ROMAN_NUMERAL_SURROUNDS = ' \t\n()[]{}\'"'
+
+
 def replace_by_index(s, i, replacement=''):
     """
     replace the character in s at index i with the strign replacement.
@@ -31,44 +39,22 @@ def capitalize_abbreviations(s:str):
     """
     return a string with all abbreviations capitalized such as 'M.', 'M.O.', 'M.O'
     """
-    i = 1
-    while i < len(s):
-        if s[i] == '.' and s[i-1] in string.ascii_letters:
-            start = i-1 # start of abbreviation
-            end = None
-            j = i
-            #test(s, i, s[i])
-            while j+2 < len(s):
-                # print(tg.red('loop 2')+'\n\t'+s+'\n')
-                if s[j+1] in string.ascii_letters: 
-                    if s[j+2] != '.': # abbreviation ends on character
-                        end = j+1
-                        i = j+3
-                        break
-                    else:
-                        j = j+2
-                else: # abbreviation ends on period
-                    end = j
-                    i = j+1
-                    break
-            # reaching this line indicates that the string ends on the presumed abbreviation. 
-            end = j
-            i = j+1
+    return _upper_spans(s, _abbreviation_spans(s))
 
-            if end is not None: 
-                # test if the supposed abbreviation is surrounded by non-letters. This filters out strings like
-                # 'abc.def' or ' f.mp3' which would otherwise be matched. 
-                pre, post = True, True
-                if start-1 >=0 and s[start-1] in string.ascii_letters:
-                    pre = False
-                if end+1 < len(s) and s[end+1] in string.ascii_letters:
-                    post = False
-                if pre and post:
-                    for x in range(start, end+1):
-                        s = replace_by_index(s, x, s[x].upper())
-        else:
-            i += 1
-    return s
+def _abbreviation_spans(s:str):
+    """
+    yield (start, end) of every abbreviation that capitalize_abbreviations() capitalizes, end exclusive.
+
+    An abbreviation is a run of letter-period pairs ('a.', 'a.b.') that isn't preceded or followed by another letter.
+    This filters out strings like 'abc.def' or ' f.mp3' which would otherwise be matched. A run that fails the test is
+    skipped as a whole: 'xa.b.' contains no abbreviation, not even 'b.'.
+    """
+    letters = string.ascii_letters
+    n = len(s)
+    for m in _ABBREVIATION.finditer(s):
+        start, end = m.span()
+        if (start == 0 or s[start-1] not in letters) and (end == n or s[end] not in letters):
+            yield start, end
 
 def contains_abbreviation(s:str):
     """
@@ -121,62 +107,72 @@ def capitalize_roman_numerals(s:str):
 
     The word vix in 'vix vapo rub' will be capitalized. Necessary evil. 
     """
-    roms = 'ivxIVX'
-    valid_surrounds = ' \t\n()[]{}\'"'
-    i = 0
-    while i < len(s):
-        if s[i] in roms:
-            start = i
-            end = None
-            j = i
-            while j+1 < len(s):
-                if s[j+1] in roms:
-                    j = j+1
-                    continue
-                else:
-                    end = j
-                    i = j+1
-                    break
-            end = j 
-            i = j + 1
-            
-            pre, post = False, False
-            if start-1 > -1:
-                if s[start-1] in valid_surrounds:
-                    pre = True
-            else:
-                pre = True
-            if end+1 < len(s): 
-                if s[end+1] in valid_surrounds:
-                    post = True
-            else:
-                post = True
-            if pre and post:
-                for x in range(start, end+1):
-                    s = replace_by_index(s, x, s[x].upper())
-                i = end + 1
-                continue
-        else:
-            i += 1
-    return s
-    
+    return _upper_spans(s, _roman_numeral_spans(s))
+
+def _roman_numeral_spans(s:str):
+    """
+    yield (start, end) of every run of IVX characters that capitalize_roman_numerals() capitalizes, end exclusive.
+    """
+    valid_surrounds = _ROMAN_NUMERAL_SURROUNDS
+    n = len(s)
+    for m in _ROMAN_NUMERAL.finditer(s):
+        start, end = m.span()
+        if (start == 0 or s[start-1] in valid_surrounds) and (end == n or s[end] in valid_surrounds):
+            yield start, end
+
+def _upper_spans(s:str, spans):
+    """
+    return s with the characters in each (start, end) span uppercased. The spans must be in order and must not overlap.
+    """
+    parts = []
+    last = 0
+    for start, end in spans:
+        parts.append(s[last:start])
+        parts.append(s[start:end].upper())
+        last = end
+    parts.append(s[last:])
+    return ''.join(parts)
+
 def advanced_titlecase(s:str):
     """
     capitalize characters that follow white space or bracket-type characters, abbreviations, roman numerals.  
-    """
 
-    # Capitalize all alpha characters that follow a whitespace. 
-    s = string.capwords(s)
+    Apart from capwords(), which runs in C, this is one regex substitution and one scan each for abbreviations and
+    roman numerals, all linear in len(s). 
+    """
+    titled = string.capwords(s)
 
     # capitalize all alpha characters that follow the opening of bracket-type characters or a slash. 
-    specials = '"([{/\\'
-    for c in specials:
+    if not titled.isascii():
+        for m in _AFTER_SPECIAL.finditer(titled):
+            if len(m.group().upper()) != 1:
+                # an uppercase like 'ß' -> 'SS' shifts the rest of the string, which the per-character rules above
+                # were never written to handle; keep the results they have always given. 
+                return _advanced_titlecase_legacy(s)
+    titled = _AFTER_SPECIAL.sub(_upper_match, titled)
+
+    # detect and capitalize abreviations and roman numerals. Both only uppercase ascii letters, which doesn't change
+    # what either of them matches, so they can be found in the same string and applied together. 
+    chars = list(titled)
+    for spans in (_abbreviation_spans(titled), _roman_numeral_spans(titled)):
+        for start, end in spans:
+            chars[start:end] = titled[start:end].upper()
+    return ''.join(chars)
+
+def _upper_match(m):
+    return m.group().upper()
+
+def _advanced_titlecase_legacy(s:str):
+    """
+    advanced_titlecase() one rule and one character at a time, for strings where uppercasing a character that follows
+    a bracket-type character or slash changes the length of the string. 
+    """
+    s = string.capwords(s)
+    for c in _TITLECASE_SPECIALS:
         indices = get_all_indices(s, c)
         for i in indices:
-            s = replace_by_index(s, i+1, str.upper(s[i+1]))
-    
-    # detect and capitalize abreviations  
+            if i+1 < len(s):
+                s = replace_by_index(s, i+1, str.upper(s[i+1]))
     s = capitalize_abbreviations(s)
     s = capitalize_roman_numerals(s)
     return s
-